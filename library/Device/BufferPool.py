@@ -0,0 +1,32 @@
+# a pool of reusable bytearrays, keyed by size
+# used by read-compare-discard workloads (like scrubbing a mirror) so steady state reads don't allocate a new buffer per block
+
+# maximum number of free buffers kept per size, anything released beyond this is left to the garbage collector
+MAX_POOLED_BUFFERS = 64
+
+_buf_pool:dict[int, list[bytearray]] = {}
+
+def acquire_buffer(size:int) -> bytearray:
+    """Get a buffer of the given size from the pool, or a new one if none are free.
+    The contents of a reused buffer are whatever its last user left in it.
+
+    Args:
+        size (int): the buffer size in bytes
+
+    Returns:
+        bytearray: a buffer of exactly size bytes
+    """
+    free = _buf_pool.get(size)
+    if free:
+        return free.pop()
+    return bytearray(size)
+
+def release_buffer(buf:bytearray):
+    """Return a buffer to the pool, the caller must not use it afterwards.
+
+    Args:
+        buf (bytearray): the buffer to return
+    """
+    free = _buf_pool.setdefault(len(buf), [])
+    if len(free) < MAX_POOLED_BUFFERS:
+        free.append(buf)
@@ -3,15 +3,34 @@
 # a virtual device can join multiple physical or virtual devices together
 
 from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+from .BufferPool import acquire_buffer, release_buffer
 from .DeviceState import DeviceState
 
+if TYPE_CHECKING:
+    from .VirtualDevice import VirtualDevice
+
 class Device(ABC):
+    __slots__ = ("name", "_parents", "_state", "_state_tag")
+    
     def __init__(self, name:str):
         self.name = name
+        self._parents:list[tuple["VirtualDevice", int]] = [] # virtual devices containing this device, and this device's index in each
 
     def __str__(self):
         return self.name
     
+    def _set_state(self, state:DeviceState):
+        """Set the state of the device, keeping the cached state tag in sync and notifying any containing virtual devices.
+
+        Args:
+            state (DeviceState): the new state
+        """
+        self._state = state
+        self._state_tag = state.TAG
+        for parent, index in self._parents:
+            parent._notify_child_state(index, state.TAG)
+    
     @abstractmethod
     def read_block(self, block_number:int) -> bytes:
         """Read a block from the device
@@ -25,6 +44,50 @@ class Device(ABC):
             ValueError: if the block number is out of range
         """        
         ...
+    def read_block_into(self, block_number:int, out:bytearray) -> None:
+        """Read a block from the device into a caller-supplied buffer.
+        Devices that can copy straight from their storage should override this to skip the intermediate bytes object.
+
+        Args:
+            block_number (int): the block number to read
+            out (bytearray): the buffer to read into, must be the length of the block size
+        Raises:
+            ValueError: if the block number is out of range
+        """
+        out[:] = self.read_block(block_number)
+    def read_block_pooled(self, block_number:int) -> bytearray:
+        """Read a block from the device into a buffer taken from the shared buffer pool.
+        Hand the buffer back with BufferPool.release_buffer once done with it.
+
+        Args:
+            block_number (int): the block number to read
+
+        Returns:
+            bytearray: the block data, will be the length of the block size
+        Raises:
+            ValueError: if the block number is out of range
+        """
+        buf = acquire_buffer(self.get_block_size())
+        try:
+            self.read_block_into(block_number, buf)
+        except Exception:
+            release_buffer(buf)
+            raise
+        return buf
+    def read_blocks(self, start_block:int, count:int) -> bytes:
+        """Read consecutive blocks from the device.
+        Devices that can serve a range in one go should override this, the default reads one block at a time.
+
+        Args:
+            start_block (int): the first block number to read
+            count (int): the number of blocks to read
+
+        Returns:
+            bytes: the data of all blocks, will be count * the block size long
+        Raises:
+            ValueError: if any block number is out of range
+        """
+        return b"".join(self.read_block(i) for i in range(start_block, start_block + count))
     @abstractmethod
     def write_block(self, block_number:int, data:bytes) -> bool:
         """Write a block to the device
@@ -39,6 +102,70 @@ class Device(ABC):
             bool: True if the write was successful, False otherwise
         """        
         ...
+    def write_blocks(self, start_block:int, data:bytes) -> bool:
+        """Write consecutive blocks to the device.
+        Devices that can take a range in one go should override this, the default writes one block at a time.
+
+        Args:
+            start_block (int): the first block number to write
+            data (bytes): the data to write, must be a multiple of the block size
+        Raises:
+            ValueError: if the data length is not a multiple of the block size
+            ValueError: if any block number is out of range
+        Returns:
+            bool: True if all writes were successful, False otherwise
+        """
+        block_size = self.get_block_size()
+        if len(data) % block_size != 0:
+            raise ValueError(f"Tried to write {len(data)} bytes, which is not a multiple of the block size {block_size}.")
+        view = memoryview(data)
+        all_successful = True
+        for i in range(len(data) // block_size):
+            all_successful = self.write_block(start_block + i, view[i * block_size:(i + 1) * block_size]) and all_successful
+        return all_successful
+    
+    def scrub_blocks(self, start_block:int, count:int, repair:bool=False) -> bool:
+        """Check that a range of blocks is intact.
+        Devices that keep redundant copies should override this to compare them, the default only checks that the range can be read.
+
+        Args:
+            start_block (int): the first block number to scrub
+            count (int): the number of blocks to scrub
+            repair (bool, optional): attempt to repair any block found to be corrupted, if the device can. Defaults to False.
+        Raises:
+            ValueError: if any block number is out of range
+            ValueError: if the device can't be read
+        Returns:
+            bool: True if all blocks are intact (or were repaired), False otherwise
+        """
+        self.read_blocks(start_block, count)
+        return True
+    
+    def prefetch_blocks(self, start_block:int, count:int):
+        """Hint that the given blocks are likely to be read soon.
+        Devices with a read cache can load them ahead of time, the default does nothing.
+
+        Args:
+            start_block (int): the first block number to prefetch
+            count (int): the number of blocks to prefetch
+        """
+        ...
+    
+    def sync(self) -> bool:
+        """Push any buffered writes down to the underlying storage.
+        Devices that don't buffer writes have nothing to do.
+
+        Returns:
+            bool: True if all buffered writes were successful, False otherwise
+        """
+        return True
+    
+    def close(self):
+        """Release whatever the device holds on to, it can't be used afterwards.
+        Devices that hold nothing have nothing to do.
+        """
+        ...
+    
     @abstractmethod
     def get_block_size(self) -> int:
         """Get the block size of the device.
@@ -1,34 +1,54 @@
 from __future__ import annotations
 
-from abc import ABC, abstractmethod
-from typing import Type
+from abc import ABC
+
+
+# state tags are bit flags, a device caches its state's tag so hot paths can test it with a single bitwise and
+# instead of isinstance checks against the mixins below
+TAG_ONLINE = 1
+TAG_OFFLINE = 2
+TAG_FAULTED = 4
+TAG_DEGRADED = 8
+TAG_ALL = TAG_ONLINE | TAG_OFFLINE | TAG_FAULTED | TAG_DEGRADED
 
 
 class DeviceState(ABC):
-    @abstractmethod
-    def transition_to(self, state:DeviceState) -> DeviceState:
-        ...
-        
-    def _check_transition(self, target:DeviceState, acceptable:list[Type[DeviceState]]) -> bool:
-        for a in acceptable:
-            if isinstance(target, a):
-                return True
-        return False
+    """States carry no data, so each state class is interned: calling it always returns the same instance.
+    Equality between states is identity (the default object __eq__/__hash__)."""
+    __slots__ = ()
+    TAG:int = 0
+    
+    def __new__(cls):
+        instance = cls.__dict__.get("_instance")
+        if instance is None:
+            instance = super().__new__(cls)
+            cls._instance = instance
+        return instance
     
-    def __eq__(self, other:object):
-        return self.__class__ == other.__class__
+    def transition_to(self, state:DeviceState) -> DeviceState:
+        """Get the state after attempting a transition to the given state.
+
+        Args:
+            state (DeviceState): the desired state
+
+        Returns:
+            DeviceState: the desired state if the transition is allowed, otherwise this state
+        """
+        if state in TRANSITIONS[self]:
+            return state
+        return self
     
     def __str__(self):
         return self.__class__.__name__
     
 class DeviceOfflineMixin(DeviceState):
-    ...
+    __slots__ = ()
     
 class DeviceOnlineMixin(DeviceState):
-    ...
+    __slots__ = ()
     
 class DeviceFaultedMixin(DeviceState):
-    ...
+    __slots__ = ()
     
 
 # ============================= Physical Device States =============================
@@ -41,37 +61,27 @@ class DeviceFaultedMixin(DeviceState):
 
 
 class PhysicalDeviceState(DeviceState):
-    ...
+    __slots__ = ()
     
 class PhysicalDeviceOnline(PhysicalDeviceState, DeviceOnlineMixin):
-    def transition_to(self, state:DeviceState):
-        if self._check_transition(state, [PhysicalDeviceOffline, PhysicalDeviceFaulted]):
-            return state
-        return self
+    __slots__ = ()
+    TAG = TAG_ONLINE
     
 class PhysicalDeviceOffline(PhysicalDeviceState, DeviceOfflineMixin):
-    def transition_to(self, state:DeviceState):
-        if self._check_transition(state, [PhysicalDeviceOnline, PhysicalDeviceDisconnected]):
-            return state
-        return self
+    __slots__ = ()
+    TAG = TAG_OFFLINE
     
 class PhysicalDeviceFaulted(PhysicalDeviceState, DeviceFaultedMixin, DeviceOnlineMixin):
-    def transition_to(self, state:DeviceState):
-        if self._check_transition(state, [PhysicalDeviceFaultedOffline]):
-            return state
-        return self
+    __slots__ = ()
+    TAG = TAG_FAULTED | TAG_ONLINE
     
 class PhysicalDeviceFaultedOffline(PhysicalDeviceState, DeviceOfflineMixin, DeviceFaultedMixin):
-    def transition_to(self, state:DeviceState):
-        if self._check_transition(state, [PhysicalDeviceFaulted]):
-            return state
-        return self    
+    __slots__ = ()
+    TAG = TAG_OFFLINE | TAG_FAULTED
     
 class PhysicalDeviceDisconnected(PhysicalDeviceState, DeviceOfflineMixin):
-    def transition_to(self, state:DeviceState):
-        if self._check_transition(state, [PhysicalDeviceOffline, PhysicalDeviceFaultedOffline]):
-            return state
-        return self
+    __slots__ = ()
+    TAG = TAG_OFFLINE
     
 # ============================= Virtual Device States =============================
 # virtual devices can be in one of three states: online, offline, faulted, faultedOffline, degraded
@@ -83,35 +93,51 @@ class PhysicalDeviceDisconnected(PhysicalDeviceState, DeviceOfflineMixin):
 
 
 class VirtualDeviceState(DeviceState):
-    ...
+    __slots__ = ()
     
     
 class VirtualDeviceOnline(VirtualDeviceState, DeviceOnlineMixin):
-    def transition_to(self, state:DeviceState):
-        if self._check_transition(state, [VirtualDeviceOffline, VirtualDeviceFaulted, VirtualDeviceDegraded]):
-            return state
-        return self
+    __slots__ = ()
+    TAG = TAG_ONLINE
     
 class VirtualDeviceOffline(VirtualDeviceState, DeviceOfflineMixin):
-    def transition_to(self, state:DeviceState):
-        if self._check_transition(state, [VirtualDeviceOnline, VirtualDeviceFaulted, VirtualDeviceDegraded]):
-            return state
-        return self
+    __slots__ = ()
+    TAG = TAG_OFFLINE
     
 class VirtualDeviceFaulted(VirtualDeviceState, DeviceFaultedMixin):
-    def transition_to(self, state:DeviceState):
-        if self._check_transition(state, [VirtualDeviceFaultedOffline, VirtualDeviceOnline, VirtualDeviceDegraded]):
-            return state
-        return self
+    __slots__ = ()
+    TAG = TAG_FAULTED
     
 class VirtualDeviceFaultedOffline(VirtualDeviceState, DeviceOfflineMixin, DeviceFaultedMixin):
-    def transition_to(self, state:DeviceState):
-        if self._check_transition(state, [VirtualDeviceFaulted]):
-            return state
-        return self
+    __slots__ = ()
+    TAG = TAG_OFFLINE | TAG_FAULTED
     
 class VirtualDeviceDegraded(VirtualDeviceState):
-    def transition_to(self, state:DeviceState):
-        if self._check_transition(state, [VirtualDeviceOffline, VirtualDeviceOnline, VirtualDeviceFaulted]):
-            return state
-        return self
\ No newline at end of file
+    __slots__ = ()
+    TAG = TAG_DEGRADED
+    
+# interned instances, compare against these with `is`
+PHYS_ONLINE = PhysicalDeviceOnline()
+PHYS_OFFLINE = PhysicalDeviceOffline()
+PHYS_FAULTED = PhysicalDeviceFaulted()
+PHYS_FAULTED_OFFLINE = PhysicalDeviceFaultedOffline()
+PHYS_DISCONNECTED = PhysicalDeviceDisconnected()
+VIRT_ONLINE = VirtualDeviceOnline()
+VIRT_OFFLINE = VirtualDeviceOffline()
+VIRT_FAULTED = VirtualDeviceFaulted()
+VIRT_FAULTED_OFFLINE = VirtualDeviceFaultedOffline()
+VIRT_DEGRADED = VirtualDeviceDegraded()
+
+# allowed transitions, source state -> states it can move to (see the comments above each state group)
+TRANSITIONS:dict[DeviceState, frozenset[DeviceState]] = {
+    PHYS_ONLINE: frozenset({PHYS_OFFLINE, PHYS_FAULTED}),
+    PHYS_OFFLINE: frozenset({PHYS_ONLINE, PHYS_DISCONNECTED}),
+    PHYS_FAULTED: frozenset({PHYS_FAULTED_OFFLINE}),
+    PHYS_FAULTED_OFFLINE: frozenset({PHYS_FAULTED}),
+    PHYS_DISCONNECTED: frozenset({PHYS_OFFLINE, PHYS_FAULTED_OFFLINE}),
+    VIRT_ONLINE: frozenset({VIRT_OFFLINE, VIRT_FAULTED, VIRT_DEGRADED}),
+    VIRT_OFFLINE: frozenset({VIRT_ONLINE, VIRT_FAULTED, VIRT_DEGRADED}),
+    VIRT_FAULTED: frozenset({VIRT_FAULTED_OFFLINE, VIRT_ONLINE, VIRT_DEGRADED}),
+    VIRT_FAULTED_OFFLINE: frozenset({VIRT_FAULTED}),
+    VIRT_DEGRADED: frozenset({VIRT_OFFLINE, VIRT_ONLINE, VIRT_FAULTED}),
+}
@@ -1,27 +1,53 @@
+from collections import OrderedDict
+from typing import Optional
+import mmap
+import os
+
 from .Device import Device
 from .DeviceState import *
 
 class PhysicalDevice(Device):
     """A physical device represents a physical disk that holds data with no redundancy."""
-    def __init__(self, name:str, size:int, block_size:int):
+    # read_block and write_block are slots rather than methods: _set_state binds the checked or unchecked implementation onto each instance
+    __slots__ = ("_size", "_block_size", "_num_blocks", "_file_backed", "_data", "_mv", "_cache_size", "_cache", "read_block", "write_block")
+    
+    def __init__(self, name:str, size:int, block_size:int, cache_size:int=0, path:Optional[str]=None):
         """Create a physical disk with a given size and block size.
 
         Args:
             size (int): disk size in bytes
             block_size (int): block size in bytes
+            cache_size (int, optional): number of recently read blocks to keep in an LRU read cache, 0 disables the cache. Defaults to 0.
+            path (Optional[str], optional): if set, the disk is backed by this file (created or resized to the disk size),
+                otherwise by anonymous memory. Defaults to None.
         """
         # validate
         assert size % block_size == 0, "Disk size must be a multiple of block size."
         assert size > 0, "Disk size must be positive."
         assert block_size > 0, "Block size must be positive."
         assert size >= block_size, "Disk size must be at least the block size."
+        assert cache_size >= 0, "Cache size must not be negative."
         
         super().__init__(name)
                 
-        self._state:DeviceState = PhysicalDeviceOffline()
+        self._set_state(PHYS_OFFLINE)
         self._size = size
         self._block_size = block_size
-        self._data = bytearray(size)
+        self._num_blocks = size // block_size
+        # storage is memory-mapped so the OS handles paging (and write-back, when backed by a file)
+        self._file_backed = path is not None
+        if path is None:
+            self._data = mmap.mmap(-1, size)
+        else:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT)
+            try:
+                os.ftruncate(fd, size)
+                self._data = mmap.mmap(fd, size)
+            finally:
+                os.close(fd) # mmap keeps its own handle to the file
+        self._mv = memoryview(self._data) # slicing a memoryview doesn't copy, only .tobytes() / assignment does
+        self._cache_size = cache_size
+        self._cache:OrderedDict[int, bytes] = OrderedDict() # block number -> data, least recently used first
         
     def transition_state(self, desired_state:PhysicalDeviceState) -> bool:
         """Attempts to transition the device to a new state, returns True if the state post-transition is the desired state.
@@ -32,11 +58,21 @@ class PhysicalDevice(Device):
         Returns:
             bool: True if the state post-transition is the desired state, False otherwise
         """        
-        self._state = self._state.transition_to(desired_state)
-        return self._state == desired_state
+        self._set_state(self._state.transition_to(desired_state))
+        return self._state is desired_state
         
-    def read_block(self, block_number:int) -> bytes:
-        """Read a block from the disk.
+    def _set_state(self, state:DeviceState):
+        super()._set_state(state)
+        # the offline check can't fail while the device is online, so bind the unchecked I/O paths straight onto the instance
+        if self._state_tag & TAG_OFFLINE:
+            self.read_block = self._read_block_checked # type: ignore
+            self.write_block = self._write_block_checked # type: ignore
+        else:
+            self.read_block = self._read_block_online # type: ignore
+            self.write_block = self._write_block_online # type: ignore
+        
+    def _read_block_checked(self, block_number:int) -> bytes:
+        """Read a block from the disk, installed as read_block while the device is offline.
 
         Args:
             block_number (int): the block number to read
@@ -47,18 +83,90 @@ class PhysicalDevice(Device):
             ValueError: if the block number is out of range
             ValueError: if the device is offline
         """
-        if block_number < 0 or block_number >= self._size // self._block_size:
+        if self._state_tag & TAG_OFFLINE:
+            raise ValueError(f"Device {self.name} is offline.")
+        return self._read_block_online(block_number)
+    
+    def _read_block_online(self, block_number:int) -> bytes:
+        """read_block without the offline check, installed as read_block while the device is online."""
+        if block_number < 0 or block_number >= self._num_blocks:
             raise ValueError(f"Block number {block_number} out of range.")
-        if self._state == PhysicalDeviceOffline():
+        if self._cache_size:
+            cached = self._cache.get(block_number)
+            if cached is not None:
+                self._cache.move_to_end(block_number)
+                return cached
+        data = self._mv[block_number * self._block_size:(block_number + 1) * self._block_size].tobytes()
+        if self._cache_size:
+            self._cache_insert(block_number, data)
+        return data
+    
+    def _cache_insert(self, block_number:int, data:bytes):
+        """Insert a block into the read cache, evicting the least recently used block if the cache is full.
+
+        Args:
+            block_number (int): the block number
+            data (bytes): the block data
+        """
+        self._cache[block_number] = data
+        self._cache.move_to_end(block_number)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+    
+    def read_block_into(self, block_number:int, out:bytearray) -> None:
+        """Read a block from the disk directly into a caller-supplied buffer, without allocating a new bytes object.
+
+        Args:
+            block_number (int): the block number to read
+            out (bytearray): the buffer to read into, must be the length of the block size
+        Raises:
+            ValueError: if the block number is out of range
+            ValueError: if the device is offline
+        """
+        if block_number < 0 or block_number >= self._num_blocks:
+            raise ValueError(f"Block number {block_number} out of range.")
+        if self._state_tag & TAG_OFFLINE:
+            raise ValueError(f"Device {self.name} is offline.")
+        out[:] = self._mv[block_number * self._block_size:(block_number + 1) * self._block_size]
+    
+    def read_blocks(self, start_block:int, count:int) -> bytes:
+        """Read consecutive blocks from the disk in a single copy.
+
+        Args:
+            start_block (int): the first block number to read
+            count (int): the number of blocks to read
+
+        Returns:
+            bytes: the data of all blocks, will be count * the block size long
+        Raises:
+            ValueError: if any block number is out of range
+            ValueError: if the device is offline
+        """
+        if start_block < 0 or count < 0 or start_block + count > self._num_blocks:
+            raise ValueError(f"Block range {start_block}-{start_block + count - 1} out of range.")
+        if self._state_tag & TAG_OFFLINE:
             raise ValueError(f"Device {self.name} is offline.")
-        return bytes(self._data[block_number * self._block_size:(block_number + 1) * self._block_size])
+        return self._mv[start_block * self._block_size:(start_block + count) * self._block_size].tobytes()
     
-    def write_block(self, block_number:int, data:bytes) -> bool:
-        """Write a block to the disk.
+    def prefetch_blocks(self, start_block:int, count:int):
+        """Load blocks into the read cache ahead of time, does nothing if the cache is disabled or the device is offline.
+
+        Args:
+            start_block (int): the first block number to prefetch
+            count (int): the number of blocks to prefetch, clipped to the end of the disk
+        """
+        if not self._cache_size or self._state_tag & TAG_OFFLINE:
+            return
+        for block_number in range(max(start_block, 0), min(start_block + count, self._num_blocks)):
+            if block_number not in self._cache:
+                self._cache_insert(block_number, self._mv[block_number * self._block_size:(block_number + 1) * self._block_size].tobytes())
+    
+    def _write_block_checked(self, block_number:int, data:bytes) -> bool:
+        """Write a block to the disk, installed as write_block while the device is offline.
 
         Args:
             block_number (int): the block number to write
-            data (bytes): the data to write
+            data (bytes): the data to write, can be any bytes-like object (bytes, bytearray, memoryview)
         Raises:
             ValueError: if the data length is not the same as the block size
             ValueError: if the block number is out of range
@@ -66,15 +174,66 @@ class PhysicalDevice(Device):
         Returns:
             bool: True if the write was successful, False otherwise
         """
+        if self._state_tag & TAG_OFFLINE:
+            raise ValueError("Device is offline.")
+        return self._write_block_online(block_number, data)
+    
+    def _write_block_online(self, block_number:int, data:bytes) -> bool:
+        """write_block without the offline check, installed as write_block while the device is online."""
         if len(data) != self._block_size:
             raise ValueError(f"Tried to write {len(data)} bytes to a block of size {self._block_size}.")
-        if block_number < 0 or block_number >= self._size // self._block_size:
+        if block_number < 0 or block_number >= self._num_blocks:
             raise ValueError(f"Block number {block_number} out of range.")
-        if self._state == PhysicalDeviceOffline():
+        self._mv[block_number * self._block_size:(block_number + 1) * self._block_size] = data
+        if self._cache_size:
+            self._cache.pop(block_number, None)
+        return True
+        
+    def write_blocks(self, start_block:int, data:bytes) -> bool:
+        """Write consecutive blocks to the disk in a single copy.
+
+        Args:
+            start_block (int): the first block number to write
+            data (bytes): the data to write, must be a multiple of the block size
+        Raises:
+            ValueError: if the data length is not a multiple of the block size
+            ValueError: if any block number is out of range
+            ValueError: if the device is offline
+        Returns:
+            bool: True if the write was successful, False otherwise
+        """
+        if len(data) % self._block_size != 0:
+            raise ValueError(f"Tried to write {len(data)} bytes, which is not a multiple of the block size {self._block_size}.")
+        count = len(data) // self._block_size
+        if start_block < 0 or start_block + count > self._num_blocks:
+            raise ValueError(f"Block range {start_block}-{start_block + count - 1} out of range.")
+        if self._state_tag & TAG_OFFLINE:
             raise ValueError("Device is offline.")
-        self._data[block_number * self._block_size:(block_number + 1) * self._block_size] = data
+        self._mv[start_block * self._block_size:(start_block + count) * self._block_size] = data
+        if self._cache_size:
+            for block_number in range(start_block, start_block + count):
+                self._cache.pop(block_number, None)
         return True
         
+    def sync(self) -> bool:
+        """Flush the memory-mapped storage to its backing file, if any.
+
+        Returns:
+            bool: True if the flush was successful
+        """
+        if self._file_backed:
+            self._data.flush()
+        return True
+    
+    def close(self):
+        """Flush the storage to its backing file, if any, and unmap it. The device can't be read or written afterwards."""
+        if self._data.closed:
+            return
+        self.sync()
+        self._cache.clear()
+        self._mv.release() # the mmap refuses to close while a view of it is still exported
+        self._data.close()
+        
     def get_block_size(self) -> int:
         return self._block_size
     
@@ -90,10 +249,10 @@ class PhysicalDevice(Device):
         Returns:
             bool: True if the device is now online, False otherwise
         """
-        return self.transition_state(PhysicalDeviceOnline())
+        return self.transition_state(PHYS_ONLINE)
     
     def mark_faulted(self) -> bool:
-        if isinstance(self._state, DeviceOnlineMixin):
-            return self.transition_state(PhysicalDeviceFaulted())
+        if self._state_tag & TAG_ONLINE:
+            return self.transition_state(PHYS_FAULTED)
         else:
-            return self.transition_state(PhysicalDeviceFaultedOffline())
\ No newline at end of file
+            return self.transition_state(PHYS_FAULTED_OFFLINE)
\ No newline at end of file
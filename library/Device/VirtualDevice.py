@@ -1,7 +1,11 @@
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Literal, Optional
 from logging import Logger
+import bisect
 import logging
 
+from .BufferPool import acquire_buffer, release_buffer
 from .Device import Device
 
 from .DeviceState import *
@@ -12,41 +16,98 @@ from .DeviceState import *
 # mirror: all devices are mirrored, minimum space, max redundancy, requires all devices to be of the same size        
 type_aggregation_options = Literal["stripe", "mirror"]
 
+# number of blocks a stripe asks its devices to prefetch once it sees sequential reads
+READ_AHEAD_BLOCKS = 8
+
+# number of blocks compared per read when scrubbing a whole mirror, clean chunks are compared as one slab per device
+INTEGRITY_CHECK_CHUNK_BLOCKS = 256
+
 
 class VirtualDevice(Device):
+    __slots__ = ("logger", "_write_intents", "_devices", "_skip_write_intents", "_dirty_state", "_online_mask", "_offline_mask", "_fault_mask", "_full_mask")
+    
     def __init__(self, name:str, logger:Optional[Logger]):
         super().__init__(name)
         
         self.logger:Logger = logger if logger is not None else logging.getLogger(__name__)
-        self._state:DeviceState = VirtualDeviceOffline()
-        self._write_intents:list[tuple[int, bytes]] = [] # writes that have not been committed yet, only populated if a device is unreachable 
-        self._devices:list[Device] = []
+        self._set_state(VIRT_OFFLINE)
+        self._write_intents:deque[tuple[int, bytes]] = deque() # writes that have not been committed yet, only populated if a device is unreachable 
+        self._devices:tuple[Device, ...] = ()
         self._skip_write_intents:bool = False # gets set to true during the attempt_bring_online process to prevent multiple write intents
+        self._dirty_state:bool = True # set when a contained device's state may have changed, the next write re-runs self_check_state
+        # bit i of each mask is set while contained device i has the matching state tag, kept up to date by _notify_child_state
+        self._online_mask:int = 0
+        self._offline_mask:int = 0
+        self._fault_mask:int = 0
+        self._full_mask:int = 0
         
         
     def get_state(self) -> DeviceState:
         return self._state
     
+    def _set_devices(self, devices:list[Device]):
+        """Set the contained devices and register self with each of them for state change notifications.
+
+        Args:
+            devices (list[Device]): the contained devices
+        """
+        self._devices = tuple(devices)
+        self._full_mask = (1 << len(self._devices)) - 1
+        for i, d in enumerate(self._devices):
+            d._parents.append((self, i))
+            self._notify_child_state(i, d._state_tag)
+    
+    def _notify_child_state(self, index:int, tag:int):
+        """Called by a contained device whenever its state is set.
+
+        Args:
+            index (int): index of the device in self._devices
+            tag (int): the state tag of the device's new state
+        """
+        bit = 1 << index
+        self._online_mask = self._online_mask | bit if tag & TAG_ONLINE else self._online_mask & ~bit
+        self._offline_mask = self._offline_mask | bit if tag & TAG_OFFLINE else self._offline_mask & ~bit
+        self._fault_mask = self._fault_mask | bit if tag & TAG_FAULTED else self._fault_mask & ~bit
+        self._dirty_state = True
+    
     def attempt_bring_online(self) -> bool:
-        self.logger.debug(f"{self.name} - Attempting to bring self virtual device online.")
+        self.logger.debug("%s - Attempting to bring self virtual device online.", self.name)
         for d in self._devices:
             d.attempt_bring_online()
         self.self_check_state()
         # do any pending writes
         if len(self._write_intents) > 0:
             self._skip_write_intents = True
-            self.logger.info(f"{self.name} - while attempting to bring virtual device online, found {len(self._write_intents)} write intents to commit.")
-            for block_number, data in self._write_intents:
+            self.logger.info("%s - while attempting to bring virtual device online, found %s write intents to commit.", self.name, len(self._write_intents))
+            # intents stay queued until committed, so a failure leaves it and everything after it in order
+            while self._write_intents:
+                block_number, data = self._write_intents[0]
                 success = self.write_block(block_number, data)
                 if not success:
-                    self.logger.error(f"{self.name} - Failed to commit write intent for block {block_number}.")
+                    self.logger.error("%s - Failed to commit write intent for block %s.", self.name, block_number)
                     break
                 else:
-                    self.logger.info(f"{self.name} - Successfully committed write intent for block {block_number}.")
-                    self._write_intents.pop(0)
+                    self.logger.info("%s - Successfully committed write intent for block %s.", self.name, block_number)
+                    self._write_intents.popleft()
             self._skip_write_intents = False
         self.self_check_state()
-        return isinstance(self._state, VirtualDeviceOnline)
+        return bool(self._state_tag & TAG_ONLINE)
+    
+    def sync(self) -> bool:
+        """Flush buffered writes on all contained devices.
+
+        Returns:
+            bool: True if all devices synced successfully, False otherwise
+        """
+        all_successful = True
+        for d in self._devices:
+            all_successful = d.sync() and all_successful
+        return all_successful
+    
+    def close(self):
+        """Close all contained devices."""
+        for d in self._devices:
+            d.close()
     
     def __str__(self):
         return f"VirtualDevice {self.name} with state {self._state} and devices {[str(d) for d in self._devices]}"
@@ -61,38 +122,43 @@ class VirtualDevice(Device):
         Returns:
             bool: True if the state was successfully transitioned, False otherwise
         """        
-        if self._state == desired_state:
-            self.logger.debug(f"{self.name} - Virtual device state already in desired state.")
+        if self._state is desired_state:
+            self.logger.debug("%s - Virtual device state already in desired state.", self.name)
             return True
         oldstate = self._state
-        self._state = self._state.transition_to(desired_state)
-        if desired_state == self._state:
-            self.logger.debug(f"{self.name} - Virtual device state successfully transitioned {oldstate} -> {desired_state}.")
+        self._set_state(self._state.transition_to(desired_state))
+        if desired_state is self._state:
+            self.logger.debug("%s - Virtual device state successfully transitioned %s -> %s.", self.name, oldstate, desired_state)
             return True
         else:
-            self.logger.error(f"{self.name} - Virtual device state FAILED TRANSITION {oldstate} -x> {desired_state}.")
+            self.logger.error("%s - Virtual device state FAILED TRANSITION %s -x> %s.", self.name, oldstate, desired_state)
             return False
                 
     def self_check_state(self):
         """Self-check the state of the virtual device, may update the state depending on the state of the contained devices."""
-        self.logger.debug(f"{self.name} - Self-checking virtual device state.")
-        if all(isinstance(d.get_state(), DeviceOnlineMixin) for d in self._devices) and not any(isinstance(d.get_state(), DeviceFaultedMixin) for d in self._devices) and len(self._write_intents) == 0:
-            self._attempt_state_update(VirtualDeviceOnline())
-        elif all(isinstance(d.get_state(), DeviceOfflineMixin) for d in self._devices) and not any(isinstance(d.get_state(), DeviceFaultedMixin) for d in self._devices):
-            self._attempt_state_update(VirtualDeviceOffline())
-        elif any(isinstance(d.get_state(), DeviceFaultedMixin) for d in self._devices) or len(self._write_intents) > 0:
-            if all(isinstance(d.get_state(), DeviceOfflineMixin) for d in self._devices):
-                self._attempt_state_update(VirtualDeviceFaultedOffline())
+        self.logger.debug("%s - Self-checking virtual device state.", self.name)
+        self._dirty_state = False
+        all_online = self._online_mask == self._full_mask
+        all_offline = self._offline_mask == self._full_mask
+        any_faulted = self._fault_mask != 0
+        if all_online and not any_faulted and len(self._write_intents) == 0:
+            self._attempt_state_update(VIRT_ONLINE)
+        elif all_offline and not any_faulted:
+            self._attempt_state_update(VIRT_OFFLINE)
+        elif any_faulted or len(self._write_intents) > 0:
+            if all_offline:
+                self._attempt_state_update(VIRT_FAULTED_OFFLINE)
             else:
-                self._attempt_state_update(VirtualDeviceFaulted())
+                self._attempt_state_update(VIRT_FAULTED)
         else:
-            self._state = VirtualDeviceDegraded()
+            self._set_state(VIRT_DEGRADED)
             
     def mark_faulted(self) -> bool:
-        if isinstance(self._state, DeviceOnlineMixin):
-            return self._attempt_state_update(VirtualDeviceFaulted())
-        elif isinstance(self._state, DeviceOfflineMixin):
-            return self._attempt_state_update(VirtualDeviceFaultedOffline())
+        self._dirty_state = True
+        if self._state_tag & TAG_ONLINE:
+            return self._attempt_state_update(VIRT_FAULTED)
+        elif self._state_tag & TAG_OFFLINE:
+            return self._attempt_state_update(VIRT_FAULTED_OFFLINE)
         return False
             
         
@@ -118,6 +184,8 @@ class VirtualDeviceFactory:
             raise ValueError(f"Unknown aggregation type {aggregation_type}.")
     
 class VirtualDeviceStripe(VirtualDevice):
+    __slots__ = ("_block_size", "_size", "_num_blocks", "_device_block_counts", "_block_number_lookup", "_uniform_blocks_per_device", "_last_read_block", "_sequential_reads", "_read_ahead_end")
+    
     def __init__(self, name:str, devices: list[Device], logger:Optional[Logger]):
         """Create a virtual device that stripes multiple physical devices together.
         All devices must be the same block size.
@@ -133,20 +201,32 @@ class VirtualDeviceStripe(VirtualDevice):
             raise ValueError("All devices must have the same block size.")
         
         super().__init__(name, logger)
-        self._devices = devices
+        self._set_devices(devices)
         self._block_size = devices[0].get_block_size()
         self._size = sum(d.get_size() for d in devices)
+        self._num_blocks = self._size // self._block_size
+        self._device_block_counts = tuple(d.get_size() // self._block_size for d in devices)
         
         self.self_check_state()
         
         # block_number_lookup to accelerate block number -> device/block_number conversion
         self._block_number_lookup:list[int] = []
         rolling_sum = 0
-        for d in devices:
+        for block_count in self._device_block_counts:
             self._block_number_lookup.append(rolling_sum)
-            rolling_sum += d.get_size() // self._block_size
+            rolling_sum += block_count
+        # when all devices are the same size the lookup is a plain divmod, no search needed
+        self._uniform_blocks_per_device:Optional[int] = None
+        if len(set(self._device_block_counts)) == 1:
+            self._uniform_blocks_per_device = self._device_block_counts[0]
+        
+        # sequential read detection for read-ahead
+        self._last_read_block = -2
+        self._sequential_reads = 0
+        self._read_ahead_end = 0 # blocks before this have already been prefetched
             
-        self.logger.info(f"Created virtual device {self.name} with devices {[str(d) for d in devices]}")
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info("Created virtual device %s with devices %s", self.name, [str(d) for d in devices])
     def _find_device_and_local_block_number(self, block_number:int) -> tuple[Device, int]:
         """Find the device and local block number for a given block number.
 
@@ -159,21 +239,111 @@ class VirtualDeviceStripe(VirtualDevice):
         Raises:
             ValueError: if the block number is out of range
         """        
-        if block_number < 0 or block_number >= self._size // self._block_size:
+        if block_number < 0 or block_number >= self._num_blocks:
             raise ValueError(f"Block number {block_number} out of range.")
         
-        for i, b_number in enumerate(self._block_number_lookup):
-            if block_number < b_number:
-                return self._devices[i-1], block_number - self._block_number_lookup[i-1]
-        return self._devices[-1], block_number - self._block_number_lookup[-1]
+        if self._uniform_blocks_per_device is not None:
+            device_index, local_block_number = divmod(block_number, self._uniform_blocks_per_device)
+            return self._devices[device_index], local_block_number
+        device_index = bisect.bisect_right(self._block_number_lookup, block_number) - 1
+        return self._devices[device_index], block_number - self._block_number_lookup[device_index]
+
+    
+    def _read_ahead(self, block_number:int):
+        """Track sequential reads, once a few in a row are seen prefetch the next READ_AHEAD_BLOCKS blocks from the devices.
 
+        Args:
+            block_number (int): the block number being read
+        """
+        if block_number == self._last_read_block + 1:
+            self._sequential_reads += 1
+        else:
+            self._sequential_reads = 0
+        self._last_read_block = block_number
+        if self._sequential_reads < 2 or block_number + 1 < self._read_ahead_end:
+            return
+        end = min(block_number + 1 + READ_AHEAD_BLOCKS, self._num_blocks)
+        for device, local_start, count in self._device_runs(block_number + 1, end - block_number - 1):
+            device.prefetch_blocks(local_start, count)
+        self._read_ahead_end = end
+    
+    def _device_runs(self, start_block:int, count:int):
+        """Split a range of global blocks into one run per device it touches.
+
+        Args:
+            start_block (int): the first global block number
+            count (int): the number of blocks
+
+        Yields:
+            tuple[Device, int, int]: the device, the first local block number on it, and the number of blocks in the run
+            
+        Raises:
+            ValueError: if the range is out of bounds
+        """
+        if count < 0 or start_block + count > self._num_blocks:
+            raise ValueError(f"Block range {start_block}-{start_block + count - 1} out of range.")
+        block = start_block
+        end = start_block + count
+        while block < end:
+            device, local_block_number = self._find_device_and_local_block_number(block)
+            run = min(end - block, device.get_size() // self._block_size - local_block_number)
+            yield device, local_block_number, run
+            block += run
+    
+    def read_blocks(self, start_block:int, count:int) -> bytes:
+        """Read consecutive blocks from the virtual device, with one multi-block read per device touched.
+
+        Args:
+            start_block (int): the first block number to read
+            count (int): the number of blocks to read
+
+        Raises:
+            ValueError: if the block range is out of range
+            ValueError: if a device is offline and cannot be brought online
+
+        Returns:
+            bytes: the block data, count * block size bytes
+        """
+        parts = []
+        for device, local_start, run in self._device_runs(start_block, count):
+            if device._state_tag & TAG_OFFLINE:
+                success = device.attempt_bring_online()
+                self.logger.info("%s - Attempted to bring device %s online, success: %s.", self.name, device, success)
+            if not device._state_tag & TAG_ONLINE:
+                raise ValueError(f"Device {device} is not online.")
+            parts.append(device.read_blocks(local_start, run))
+        return b"".join(parts)
+    
+    def scrub_blocks(self, start_block:int, count:int, repair:bool=False) -> bool:
+        """Scrub a range of blocks, with one scrub per device touched.
+        Contained mirrors compare (and if asked, repair) their copies, other devices are read back.
+
+        Args:
+            start_block (int): the first block number to scrub
+            count (int): the number of blocks to scrub
+            repair (bool, optional): attempt to repair any block found to be corrupted. Defaults to False.
+
+        Raises:
+            ValueError: if the block range is out of range
+
+        Returns:
+            bool: True if every block is intact (or was repaired), False otherwise
+        """
+        all_successful = True
+        for device, local_start, run in self._device_runs(start_block, count):
+            try:
+                all_successful = device.scrub_blocks(local_start, run, repair) and all_successful
+            except ValueError as e:
+                self.logger.error("%s - Scrub failed on device %s for local blocks %s-%s: %s", self.name, device, local_start, local_start + run - 1, e)
+                all_successful = False
+        return all_successful
     
     def write_block(self, block_number:int, data:bytes) -> bool:
         """Write a block to the virtual device.
 
         Args:
             block_number (int): the block number to write
-            data (bytes): the data to write
+            data (bytes): the data to write, can be any bytes-like object, it is passed through to the underlying device without copying
         Raises:
             ValueError: if the data length is not the same as the block size
         Returns: 
@@ -181,19 +351,56 @@ class VirtualDeviceStripe(VirtualDevice):
         """
         if len(data) != self._block_size:
             raise ValueError(f"Tried to write {len(data)} bytes to a block of size {self._block_size}.")
-        self.self_check_state()
+        if self._dirty_state:
+            self.self_check_state()
         device, local_block_number = self._find_device_and_local_block_number(block_number)
-        if isinstance(device.get_state(), DeviceOfflineMixin):
+        if device._state_tag & TAG_OFFLINE:
             success = device.attempt_bring_online()
-            self.logger.info(f"{self.name} - Attempted to bring device {device} online, success: {success}.")
-        if isinstance(device.get_state(), DeviceOnlineMixin):
+            self.logger.info("%s - Attempted to bring device %s online, success: %s.", self.name, device, success)
+        if device._state_tag & TAG_ONLINE:
             return device.write_block(local_block_number, data)
         else:
             if not self._skip_write_intents:
-                self._write_intents.append((block_number, data))
-            self.logger.error(f"{self.name} - Failed to write block {block_number}, device {device} is not online.")
-            self._attempt_state_update(VirtualDeviceFaulted()) # because we can't write to the device, data is lost until we actually can write it
+                self._write_intents.append((block_number, bytes(data)))
+            self.logger.error("%s - Failed to write block %s, device %s is not online.", self.name, block_number, device)
+            self._attempt_state_update(VIRT_FAULTED) # because we can't write to the device, data is lost until we actually can write it
             return False
+    def write_blocks(self, start_block:int, data:bytes) -> bool:
+        """Write consecutive blocks to the virtual device, with one multi-block write per device touched.
+
+        Args:
+            start_block (int): the first block number to write
+            data (bytes): the data to write, must be a multiple of the block size
+        Raises:
+            ValueError: if the data length is not a multiple of the block size
+            ValueError: if the block range is out of range
+        Returns:
+            bool: True if all writes were successful, False otherwise
+        """
+        if len(data) % self._block_size != 0:
+            raise ValueError(f"Tried to write {len(data)} bytes, which is not a multiple of the block size {self._block_size}.")
+        if self._dirty_state:
+            self.self_check_state()
+        view = memoryview(data)
+        all_successful = True
+        block = start_block
+        for device, local_start, run in self._device_runs(start_block, len(data) // self._block_size):
+            chunk = view[(block - start_block) * self._block_size:(block - start_block + run) * self._block_size]
+            if device._state_tag & TAG_OFFLINE:
+                success = device.attempt_bring_online()
+                self.logger.info("%s - Attempted to bring device %s online, success: %s.", self.name, device, success)
+            if device._state_tag & TAG_ONLINE:
+                all_successful = device.write_blocks(local_start, chunk) and all_successful
+            else:
+                all_successful = False
+                if not self._skip_write_intents:
+                    for i in range(run):
+                        self._write_intents.append((block + i, bytes(chunk[i * self._block_size:(i + 1) * self._block_size])))
+                self.logger.error("%s - Failed to write blocks %s-%s, device %s is not online.", self.name, block, block + run - 1, device)
+                self._attempt_state_update(VIRT_FAULTED)
+            block += run
+        return all_successful
+    
     def read_block(self, block_number:int) -> bytes:
         """Read a block from the virtual device.
 
@@ -208,12 +415,34 @@ class VirtualDeviceStripe(VirtualDevice):
             bytes: the block data, will be the length of the block size
         """
         device, local_block_number = self._find_device_and_local_block_number(block_number)
-        if isinstance(device.get_state(), DeviceOfflineMixin):
+        self._read_ahead(block_number)
+        if device._state_tag & TAG_OFFLINE:
             success = device.attempt_bring_online()
-            self.logger.info(f"{self.name} - Attempted to bring device {device} online, success: {success}.")
-        if isinstance(device.get_state(), DeviceOnlineMixin):
+            self.logger.info("%s - Attempted to bring device %s online, success: %s.", self.name, device, success)
+        if device._state_tag & TAG_ONLINE:
             return device.read_block(local_block_number)
         raise ValueError(f"Device {device} is not online.")
+    
+    def read_block_into(self, block_number:int, out:bytearray) -> None:
+        """Read a block from the virtual device directly into a caller-supplied buffer.
+
+        Args:
+            block_number (int): the block number to read
+            out (bytearray): the buffer to read into, must be the length of the block size
+
+        Raises:
+            ValueError: if the block number is out of range
+            ValueError: if the device is offline and cannot be brought online
+        """
+        device, local_block_number = self._find_device_and_local_block_number(block_number)
+        self._read_ahead(block_number)
+        if device._state_tag & TAG_OFFLINE:
+            success = device.attempt_bring_online()
+            self.logger.info("%s - Attempted to bring device %s online, success: %s.", self.name, device, success)
+        if device._state_tag & TAG_ONLINE:
+            device.read_block_into(local_block_number, out)
+            return
+        raise ValueError(f"Device {device} is not online.")
 
     def get_block_size(self) -> int:
         return self._block_size
@@ -222,12 +451,18 @@ class VirtualDeviceStripe(VirtualDevice):
         return self._size
     
 class VirtualDeviceMirror(VirtualDevice):
-    def __init__(self, name:str, devices:list[Device], logger:Optional[Logger]):
+    __slots__ = ("_block_size", "_size", "_num_blocks", "_write_behind_blocks", "_dirty", "_parallel_writes", "_executor")
+    
+    def __init__(self, name:str, devices:list[Device], logger:Optional[Logger], write_behind_blocks:int=0, parallel_writes:bool=False):
         """Create a virtual device that mirrors multiple physical devices together.
         All devices must be the same size and block size.
         
         Args:
             devices (list[Device]): the physical devices to mirror
+            write_behind_blocks (int, optional): if set, writes are buffered and flushed to the devices in contiguous runs
+                once this many blocks are dirty (or on sync()), 0 writes through immediately. Defaults to 0.
+            parallel_writes (bool, optional): if set, the legs are written concurrently from a thread pool owned by this device.
+                Only worth it when the devices release the GIL while writing (file backed devices), in memory devices are faster without it. Defaults to False.
         Raises:
             ValueError: if the devices have different sizes or block sizes
         """
@@ -238,11 +473,17 @@ class VirtualDeviceMirror(VirtualDevice):
             raise ValueError("All devices must have the same block size.")
         
         super().__init__(name, logger)
-        self._devices = devices
+        self._set_devices(devices)
         self._block_size = devices[0].get_block_size()
         self._size = devices[0].get_size()
+        self._num_blocks = self._size // self._block_size
+        self._write_behind_blocks = write_behind_blocks
+        self._dirty:dict[int, bytes] = {} # block number -> data not yet written to the devices
+        self._parallel_writes = parallel_writes and len(self._devices) > 1
+        self._executor:Optional[ThreadPoolExecutor] = None # created on the first parallel write
         self.self_check_state()
-        self.logger.info(f"Created virtual device {self.name} with devices {[str(d) for d in devices]}")
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info("Created virtual device %s with devices %s", self.name, [str(d) for d in devices])
         
     def get_block_size(self) -> int:
         return self._block_size
@@ -250,36 +491,113 @@ class VirtualDeviceMirror(VirtualDevice):
     def get_size(self) -> int:
         return self._size
     
+    def attempt_bring_online(self) -> bool:
+        self._flush_dirty()
+        return super().attempt_bring_online()
+    
+    def mark_faulted(self) -> bool:
+        self._flush_dirty()
+        return super().mark_faulted()
+    
     def write_block(self, block_number:int, data:bytes) -> bool:
         """Write a block to the virtual device.
+        With write-behind enabled the block is buffered, and only written to the devices when the buffer fills up or on sync().
 
         Args:
             block_number (int): the block number to write
             data (bytes): the data to write
         Raises:
             ValueError: if the data length is not the same as the block size
+            ValueError: if the block number is out of range (write-behind only, otherwise raised by the devices)
         Returns:
             bool: True if the write was successful, False otherwise
         """
         if len(data) != self._block_size:
             raise ValueError(f"Tried to write {len(data)} bytes to a block of size {self._block_size}.")
-        for d in self._devices:
-            if not isinstance(d.get_state(), DeviceOnlineMixin):
-                success = d.attempt_bring_online()
-                self.logger.info(f"{self.name} - Attempted to bring device {d} online, success: {success}.")
-        self.self_check_state()
+        # write intent replays go straight through, they are already being committed
+        if self._write_behind_blocks and not self._skip_write_intents:
+            if block_number < 0 or block_number >= self._num_blocks:
+                raise ValueError(f"Block number {block_number} out of range.")
+            self._dirty[block_number] = bytes(data)
+            if len(self._dirty) >= self._write_behind_blocks:
+                return self._flush_dirty()
+            return True
+        return self._write_run(block_number, data)
+    
+    def sync(self) -> bool:
+        """Write all buffered blocks to the devices, then sync the devices as well.
+
+        Returns:
+            bool: True if all buffered writes were successful, False otherwise
+        """
+        return self._flush_dirty() and super().sync()
+    
+    def close(self):
+        """Flush any buffered writes, shut down the write thread pool if one was started, then close the contained devices."""
+        self._flush_dirty()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        super().close()
+    
+    def _flush_dirty(self) -> bool:
+        """Write all buffered blocks to the devices, each contiguous run of dirty blocks is written as one multi-block write.
+
+        Returns:
+            bool: True if all buffered writes were successful, False otherwise
+        """
+        if not self._dirty:
+            return True
+        dirty = self._dirty
+        self._dirty = {}
+        block_numbers = sorted(dirty)
+        all_successful = True
+        run_start = 0
+        for i in range(1, len(block_numbers) + 1):
+            if i == len(block_numbers) or block_numbers[i] != block_numbers[i - 1] + 1:
+                payload = b"".join(dirty[b] for b in block_numbers[run_start:i])
+                all_successful = self._write_run(block_numbers[run_start], payload) and all_successful
+                run_start = i
+        return all_successful
+    
+    def _write_run(self, start_block:int, data:bytes) -> bool:
+        """Write one or more consecutive blocks to every device, queueing write intents for them if any device fails.
+
+        Args:
+            start_block (int): the first block number to write
+            data (bytes): the data to write, a multiple of the block size
+
+        Returns:
+            bool: True if the write was successful on all devices, False otherwise
+        """
+        if self._online_mask != self._full_mask:
+            for d in self._devices:
+                if not d._state_tag & TAG_ONLINE:
+                    success = d.attempt_bring_online()
+                    self.logger.info("%s - Attempted to bring device %s online, success: %s.", self.name, d, success)
+        if self._dirty_state:
+            self.self_check_state()
         
-        # write to as many devices as possible
-        successes:list[bool] = []
-        for d in self._devices:
-            if isinstance(d.get_state(), DeviceOnlineMixin):
-                successes.append(d.write_block(block_number, data))
-            else:
-                successes.append(False)
-        if not all(successes):
-            self.logger.error(f"{self.name} - Failed to write block {block_number} to all devices, {sum(successes)} out of {len(self._devices)} succeeded (failing: {[d for i,d in enumerate(self._devices) if not successes[i]]}), vdev is faulted.")
-            self._attempt_state_update(VirtualDeviceFaulted())
-            self._write_intents.append((block_number, data))
+        # write to as many devices as possible, only keeping track of the failures
+        failing:list[Device] = []
+        if self._parallel_writes:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=len(self._devices), thread_name_prefix=self.name)
+            futures = [(d, self._executor.submit(d.write_blocks, start_block, data)) for d in self._devices if d._state_tag & TAG_ONLINE]
+            failing = [d for d in self._devices if not d._state_tag & TAG_ONLINE]
+            failing.extend(d for d, f in futures if not f.result())
+        else:
+            for d in self._devices:
+                if not (d._state_tag & TAG_ONLINE and d.write_blocks(start_block, data)):
+                    failing.append(d)
+        if failing:
+            count = len(data) // self._block_size
+            blocks = f"block {start_block}" if count == 1 else f"blocks {start_block}-{start_block + count - 1}"
+            self.logger.error("%s - Failed to write %s to all devices, %s out of %s succeeded (failing: %s), vdev is faulted.", self.name, blocks, len(self._devices) - len(failing), len(self._devices), [str(d) for d in failing])
+            self._attempt_state_update(VIRT_FAULTED)
+            if not self._skip_write_intents:
+                for i in range(count):
+                    self._write_intents.append((start_block + i, bytes(data[i * self._block_size:(i + 1) * self._block_size])))
             return False
         return True
             
@@ -292,29 +610,30 @@ class VirtualDeviceMirror(VirtualDevice):
         Returns:
             bytes: the block data, will be the length of the block size
         """
+        dirty = self._dirty.get(block_number)
+        if dirty is not None:
+            return dirty
         if not self.check_integrity(block_number):
             # get what data we can and return it, mark any device returning different data as faulted
-            self.logger.error(f"{self.name} - Data corruption detected in block {block_number}.")
-            self._attempt_state_update(VirtualDeviceFaulted())
+            self.logger.error("%s - Data corruption detected in block %s.", self.name, block_number)
+            self._attempt_state_update(VIRT_FAULTED)
             all_data = [d.read_block(block_number) for d in self._devices]
-            freqs:dict[bytes, int] = {}
-            for d in all_data:
-                freqs[d] = freqs.get(d, 0) + 1
+            freqs = Counter(all_data)
                 
             highest_freq = max(freqs.values())
             most_common_data = [d for d in freqs if freqs[d] == highest_freq]
             if len(most_common_data) == 1:
                 final_data = most_common_data[0]
             else:
-                self.logger.error(f"{self.name} - Data corruption detected in block {block_number}, no common data found.")
+                self.logger.error("%s - Data corruption detected in block %s, no common data found.", self.name, block_number)
                 final_data = None
             # mark all devices with different data as faulted
             for i, d in enumerate(all_data):
                 if d != final_data:
-                    self.logger.error(f"{self.name} - Device {self._devices[i]} returned different data than majority, marking as faulted.")
+                    self.logger.error("%s - Device %s returned different data than majority, marking as faulted.", self.name, self._devices[i])
                     success = self._devices[i].mark_faulted()
                     if not success:
-                        self.logger.error(f"{self.name} - Failed to mark device {self._devices[i]} as faulted.")
+                        self.logger.error("%s - Failed to mark device %s as faulted.", self.name, self._devices[i])
                         raise ValueError(f"Failed to mark device {self._devices[i]} as faulted.")
             if final_data is not None:
                 return final_data
@@ -332,17 +651,30 @@ class VirtualDeviceMirror(VirtualDevice):
         Returns:
             bool: True if all devices have the same data (no issue, or repair was successful), False otherwise
         """
-        self.logger.info(f"{self.name} - Checking integrity of block {block_number}.")
-        data_dict:dict[bytes,int] = {}
-        for d in self._devices:
-            data = d.read_block(block_number)
-            data_dict[data] = data_dict.get(data, 0) + 1
-        if len(data_dict) == 1:
+        # only a buffered copy of this block needs to reach the devices first, the rest of the buffer can stay put
+        if block_number in self._dirty:
+            self._flush_dirty()
+        self.logger.info("%s - Checking integrity of block %s.", self.name, block_number)
+        # happy path: compare every leg against the first and stop at the first difference, using pooled buffers
+        consistent = True
+        reference = self._devices[0].read_block_pooled(block_number)
+        scratch = acquire_buffer(self._block_size)
+        try:
+            for d in self._devices[1:]:
+                d.read_block_into(block_number, scratch)
+                if scratch != reference:
+                    consistent = False
+                    break
+        finally:
+            release_buffer(reference)
+            release_buffer(scratch)
+        if consistent:
             return True
+        data_dict = Counter(d.read_block(block_number) for d in self._devices)
         self.mark_faulted()
 
 
-        self.logger.error(f"{self.name} - Data corruption detected in block {block_number}{', attempting repair.' if repair else '.'}")
+        self.logger.error("%s - Data corruption detected in block %s%s", self.name, block_number, ', attempting repair.' if repair else '.')
         highest = max(data_dict.values())
         most_common_data = [d for d in data_dict if data_dict[d] == highest]
         if len(most_common_data) == 1:
@@ -356,13 +688,13 @@ class VirtualDeviceMirror(VirtualDevice):
                     # if we can't re-write the correct data, repair is impossible
                     repair_successful = False
             if repair and repair_successful:
-                self.logger.info(f"{self.name} - Repair successful for block {block_number}.")
+                self.logger.info("%s - Repair successful for block %s.", self.name, block_number)
                 return True
             elif repair:
-                self.logger.error(f"{self.name} - Repair failed for block {block_number}.")
+                self.logger.error("%s - Repair failed for block %s.", self.name, block_number)
             return False
         # else, no majority data, can't repair
-        self.logger.critical(f"{self.name} - Data corruption detected in block {block_number}, no majority data found, repair{" would be" if not repair else ""} impossible.")
+        self.logger.critical("%s - Data corruption detected in block %s, no majority data found, repair%s impossible.", self.name, block_number, " would be" if not repair else "")
         return False
     
     def check_all_integrity(self, repair:bool=False) -> bool:
@@ -374,8 +706,34 @@ class VirtualDeviceMirror(VirtualDevice):
         Returns:
             bool: True if all blocks had no errors, False otherwise
         """        
-        for block in range(self._size // self._block_size):
-            if not self.check_integrity(block, repair):
-                return False
+        return self.scrub_blocks(0, self._num_blocks, repair)
+    
+    def scrub_blocks(self, start_block:int, count:int, repair:bool=False) -> bool:
+        """Check the integrity of a range of blocks, stopping at the first block that is corrupted and can't be repaired.
+
+        Args:
+            start_block (int): the first block number to check
+            count (int): the number of blocks to check
+            repair (bool, optional): attempt to repair any block found to be corrupted. Defaults to False.
+
+        Raises:
+            ValueError: if the block range is out of range
+
+        Returns:
+            bool: True if all blocks had no errors (or were repaired), False otherwise
+        """
+        if start_block < 0 or count < 0 or start_block + count > self._num_blocks:
+            raise ValueError(f"Block range {start_block}-{start_block + count - 1} out of range.")
+        self._flush_dirty()
+        end_block = start_block + count
+        for chunk_start in range(start_block, end_block, INTEGRITY_CHECK_CHUNK_BLOCKS):
+            count = min(INTEGRITY_CHECK_CHUNK_BLOCKS, end_block - chunk_start)
+            reference = self._devices[0].read_blocks(chunk_start, count)
+            if all(d.read_blocks(chunk_start, count) == reference for d in self._devices[1:]):
+                continue
+            # something in this chunk differs, narrow it down block by block
+            for block in range(chunk_start, chunk_start + count):
+                if not self.check_integrity(block, repair):
+                    return False
         return True
     
\ No newline at end of file
@@ -1,5 +1,13 @@
+from array import array
+import struct
+
 from library.StoragePool import StoragePool
-from library.FileSystemFileTable import FileSystemFileTable
+from library.FileSystemFileTable import FileSystemFileTable, BLOCK_NUMBER_TYPECODE
+
+# the file table is stored behind a big endian uint32 byte length
+_table_length = struct.Struct(">I")
+_pack_table_length = _table_length.pack
+_unpack_table_length = _table_length.unpack_from
 
 class FileSystem:
     """The Filesystem interacts with a StoragePool to provide an easier to use interface
@@ -11,8 +19,12 @@ class FileSystem:
     when the files cross the boundary of the file table, the system is full
     """
     def __init__(self, storage_pool:StoragePool):
-        storage_pool.write_virtual_blocks(0, b"\x00"*storage_pool.get_block_size()*4)
         self._storage_pool = storage_pool
+        # only initialize an empty file table if the pool doesn't already hold one
+        header_blocks = storage_pool.bytes2block_count(4)
+        if not all(storage_pool.check_virtual_block(b) for b in range(header_blocks)) or \
+                _unpack_table_length(storage_pool.read_virtual_blocks_byte_count(0, 4), 0)[0] == 0:
+            storage_pool.write_virtual_blocks(0, bytes(storage_pool.get_block_size()*4))
         
     def _read_file_table(self) -> FileSystemFileTable:
         """Read the file table from the storage pool
@@ -20,79 +32,47 @@ class FileSystem:
         Returns:
             dict[str, list[int]]: filename -> list of block numbers
         """
-        table_length_bytes = self.get_pool().read_virtual_blocks_byte_count(0,4)
-        file_table_length = int.from_bytes(table_length_bytes, "big")
-        table_bytes = self.get_pool().read_virtual_blocks_byte_count(0, file_table_length+4)
-        table_bytes = table_bytes[4:]
-        return FileSystemFileTable(table_bytes)
+        # the table is a 4 byte length header followed by the encoded table, read the block(s) holding the header and only fetch the rest if it spills over
+        pool = self.get_pool()
+        head = pool.read_virtual_blocks_byte_count(0, pool.bytes2block_count(4) * pool.get_block_size())
+        (file_table_length,) = _unpack_table_length(head, 0)
+        if file_table_length + 4 > len(head):
+            head += pool.read_virtual_blocks_byte_count(len(head) // pool.get_block_size(), file_table_length + 4 - len(head))
+        return FileSystemFileTable(head[4:4+file_table_length])
 
     
-    def _get_highest_used_block(self) -> int:
-        """Find the lowest numbered block that is used"""
+    def _scan_used(self) -> tuple[set[int], int, FileSystemFileTable]:
+        """Read the file table and collect the used blocks and the lowest used block in a single pass
+
+        Returns:
+            tuple[set[int], int, FileSystemFileTable]: used blocks, lowest used block (the block count if none are used), and the file table
+        """
         table = self._read_file_table()
+        used_blocks:set[int] = set()
         lowest = self.get_pool().get_num_blocks()
         for _, block_list in table.file_table.values():
-            for block in block_list:
-                if block < lowest:
-                    lowest = block
-        return lowest
-    
-    def _get_used_blocks(self) -> set[int]:
-        """Get a set of all blocks in use by files in the pool"""
-        file_table = self._read_file_table()
-        used_blocks:set[int] = set()
-        for _, block_list in file_table.file_table.values():
-            used_blocks.update(block_list)
-        return used_blocks
+            if block_list:
+                used_blocks.update(block_list)
+                lowest = min(lowest, min(block_list))
+        return used_blocks, lowest, table
     
-    def _find_free_space(self, num_blocks:int) -> list[int]:
-        """Find free space in the storage pool
-
-        Args:
-            num_blocks (int): number of blocks to find
-
-        Returns:
-            list[int]: a list of block numbers that are free, will be length num_blocks
-        """
-        used_blocks = self._get_used_blocks()
-        free_blocks:list[int] = []
-        for i in range(0, self.get_pool().get_num_blocks(), -1):
-            if i not in used_blocks:
-                free_blocks.append(i)
-            if len(free_blocks) == num_blocks:
-                return free_blocks
-        raise ValueError("Filesystem is full, cannot find free space")
-        
-        
-        
-    def _write_file_table(self, file_table:FileSystemFileTable):
+    def _write_file_table(self, file_table:FileSystemFileTable, lowest_used_block:int):
         """Write the file table to the storage pool
 
         Args:
             file_table (dict[str, list[int]]): filename -> list of block numbers
+            lowest_used_block (int): the lowest block used by any file in file_table, the table must fit below it
         Raises:
             ValueError: if the filesystem is full, or if there is no way to write the file table to the storage pool
             OverflowError: if the file table is too large to be written (greater than 65535 bytes)
         """
         encoded = file_table.encode()
-        encoded = len(encoded).to_bytes(4, "big") + encoded
-        lowest_used_block = self._get_highest_used_block()
+        encoded = _pack_table_length(len(encoded)) + encoded
         if lowest_used_block < len(encoded):
             raise ValueError("Filesystem is full, or needs to be defragmented")
         self.get_pool().write_virtual_blocks(0, encoded)
         
         
-    def _update_file_table(self, filename:str, file_length:int, block_numbers:list[int]):
-        """Update the file table with the given block numbers
-
-        Args:
-            filename (str): filename to update
-            block_numbers (list[int]): list of block numbers
-        """
-        file_table = self._read_file_table()
-        file_table.file_table[filename] = (file_length, block_numbers)
-        self._write_file_table(file_table)
-        
     def write_file(self, filename:str, data:bytes):
         """Write a file to the storage pool
 
@@ -106,26 +86,34 @@ class FileSystem:
         """        
         if len(filename) > 255:
             raise ValueError("Filename too long")
-        highest_free_block = self._get_highest_used_block() - 1
-        test_filetable = self._read_file_table()
+        # read the file table once, everything below works off this copy
+        used_blocks, lowest_used_block, test_filetable = self._scan_used()
+        highest_free_block = lowest_used_block - 1
         num_required_blocks = self.get_pool().bytes2block_count(len(data))
         blocks_to_write = [highest_free_block-i for i in range(num_required_blocks)]
         pool_block_size = self.get_pool().get_block_size()
-        test_filetable.file_table[filename] = (len(data), [])
         data_length = len(data)
         for block_to_write in blocks_to_write:
-            if block_to_write in self._get_used_blocks():
+            if block_to_write in used_blocks:
                 raise ValueError("Filesystem is full, or needs to be defragmented")
-            data_fragment = data[:pool_block_size]
-            if len(data_fragment) < pool_block_size:
-                data_fragment += b"\x00"*(pool_block_size-len(data_fragment))
-            data = data[pool_block_size:]
-            self.get_pool().write_virtual_block(block_to_write, data_fragment)
-            test_filetable.file_table[filename][1].append(block_to_write)
+            used_blocks.add(block_to_write)
+        if blocks_to_write:
+            # the blocks count down from highest_free_block, so the fragments are written in reverse as one ascending multi-block write
+            # fragments are views into data, the only copy made is the final join (plus padding the last fragment)
+            mv = memoryview(data)
+            fragments:list[bytes|memoryview] = [mv[i*pool_block_size:(i+1)*pool_block_size] for i in range(num_required_blocks)]
+            pad_length = num_required_blocks*pool_block_size - data_length
+            if pad_length:
+                fragments[-1] = bytes(fragments[-1]) + b"\x00"*pad_length
+            fragments.reverse()
+            self.get_pool().write_virtual_blocks(blocks_to_write[-1], b"".join(fragments))
+            # the table written below includes the new file, so its blocks count towards the space check
+            lowest_used_block = min(lowest_used_block, blocks_to_write[-1])
+        test_filetable.file_table[filename] = (data_length, array(BLOCK_NUMBER_TYPECODE, blocks_to_write))
         encoded_test_filetable = test_filetable.encode()
         if len(encoded_test_filetable)+4 > highest_free_block:
             raise ValueError("Filesystem is full, or needs to be defragmented")
-        self._update_file_table(filename, data_length, test_filetable.file_table[filename][1])
+        self._write_file_table(test_filetable, lowest_used_block)
         
     def read_file(self, filename:str) -> bytes:
         """Read a file from the storage pool
@@ -1,3 +1,16 @@
+from array import array
+from collections.abc import MutableSequence
+import struct
+import sys
+
+# fixed size header fields, big endian: filename length, file size, block count (block numbers follow as big endian uint32s)
+_unpack_u16 = struct.Struct(">H").unpack_from
+_unpack_u32 = struct.Struct(">I").unpack_from
+
+# in memory, block numbers are kept in a compact array of 4 byte unsigned ints rather than a list of python ints
+BLOCK_NUMBER_TYPECODE = "I" if array("I").itemsize == 4 else "L"
+_SWAP_BYTES = sys.byteorder == "little" # the encoded table is big endian
+
 class FileSystemFileTable:
     def __init__(self, data:bytes):
         """Create a new file table from the given data, or an empty file table if no data is given.
@@ -7,25 +20,33 @@ class FileSystemFileTable:
         """
         # file table is {filename -> (size in bytes, ordered list of block numbers)}
         if data:
-            self.file_table:dict[str, tuple[int,list[int]]] = self._decode_file_table(data)
+            self.file_table:dict[str, tuple[int,MutableSequence[int]]] = self._decode_file_table(data)
         else:
-            self.file_table:dict[str, tuple[int,list[int]]] = {}
+            self.file_table:dict[str, tuple[int,MutableSequence[int]]] = {}
             
     def encode(self) -> bytes:
         """
         Raises:
-            OverflowError: if items in the file table exceed the maximum size: 65535 bytes for filename, 4GB for file size, 65535 blocks per file
+            OverflowError: if items in the file table exceed the maximum size: 65535 bytes for filename, 4GB for file size, 65535 blocks per file,
+                block numbers up to 2**32-1
         
         Returns:
             bytes: byte encoded representation of the file table
         """
         list_output:list[bytes] = []
         for filename, (size, block_numbers) in self.file_table.items():
-            list_output.append(len(filename).to_bytes(2, "big")) # path length can be at most 65535 bytes
-            list_output.append(filename.encode())
+            encoded_filename = filename.encode()
+            list_output.append(len(encoded_filename).to_bytes(2, "big")) # path length can be at most 65535 bytes
+            list_output.append(encoded_filename)
             list_output.append(size.to_bytes(4, "big")) # files can be at most 4GB
             list_output.append(len(block_numbers).to_bytes(2, "big")) # files can have at most 65535 blocks
-            list_output.append(bytes(block_numbers))
+            try:
+                encoded_blocks = array(BLOCK_NUMBER_TYPECODE, block_numbers) # block numbers are 4 bytes each
+            except OverflowError as e:
+                raise OverflowError(f"Block number out of range for file {filename}.") from e
+            if _SWAP_BYTES:
+                encoded_blocks.byteswap()
+            list_output.append(encoded_blocks.tobytes())
         return b"".join(list_output)
     
     def _decode_file_table(self, data:bytes):
@@ -34,26 +55,31 @@ class FileSystemFileTable:
         Args:
             data (bytes): data to decode
         """
-        file_table:dict[str, tuple[int, list[int]]] = {}
+        file_table:dict[str, tuple[int, MutableSequence[int]]] = {}
+        mv = memoryview(data)
         i = 0
-        while i < len(data):
-            filename_length = int.from_bytes(data[i:i+2], "big")
+        end = len(data)
+        while i < end:
+            (filename_length,) = _unpack_u16(mv, i)
             i += 2
-            filename = data[i:i+filename_length].decode()
+            filename = str(mv[i:i+filename_length], "utf-8")
             i += filename_length
-            size = int.from_bytes(data[i:i+4], "big")
+            (size,) = _unpack_u32(mv, i)
             i += 4
-            block_count = int.from_bytes(data[i:i+2], "big")
+            (block_count,) = _unpack_u16(mv, i)
             i += 2
-            block_numbers = list(data[i:i+block_count])
-            i += block_count
+            block_numbers = array(BLOCK_NUMBER_TYPECODE)
+            block_numbers.frombytes(mv[i:i+4*block_count])
+            if _SWAP_BYTES:
+                block_numbers.byteswap()
+            i += 4*block_count
             file_table[filename] = (size, block_numbers)
         return file_table        
     
     def __contains__(self, filename:object) -> bool:
         return filename in self.file_table
     
-    def __getitem__(self, filename:object) -> tuple[int, list[int]]:
+    def __getitem__(self, filename:object) -> tuple[int, MutableSequence[int]]:
         if not isinstance(filename, str):
             raise TypeError("filename must be a string")
         return self.file_table[filename]
\ No newline at end of file
@@ -1,13 +1,22 @@
 from __future__ import annotations
+from typing import Optional
 
-from library.Device.Device import Device
+from library.Device.VirtualDevice import VirtualDevice
 
 class PhysicalVirtualBlockMapping:
     def __init__(self):
-        self._physical_to_virtual_map: dict[Device, dict[int, int]] = {}
-        self._virtual_to_physical_map: dict[int, tuple[Device, int]] = {}
+        self._physical_to_virtual_map: dict[VirtualDevice, dict[int, int]] = {}
+        self._virtual_to_physical_map: dict[int, tuple[VirtualDevice, int]] = {}
+        self._shared = False # set while the tables are shared with a copy made by get_snapshot, they get copied before the next change
+    
+    def _make_private(self):
+        """Copy the tables if they are shared with another mapping, must be called before any change to them."""
+        if self._shared:
+            self._virtual_to_physical_map = dict(self._virtual_to_physical_map)
+            self._physical_to_virtual_map = {device: dict(mapping) for device, mapping in self._physical_to_virtual_map.items()}
+            self._shared = False
         
-    def enroll_mapping(self, device:Device, physical_block:int, virtual_block:int):
+    def enroll_mapping(self, device:VirtualDevice, physical_block:int, virtual_block:int):
         """Enroll a mapping in the mapping table.
 
         Args:
@@ -23,17 +32,18 @@ class PhysicalVirtualBlockMapping:
             raise ValueError(f"Virtual block {virtual_block} already in use.")
         if self.check_physical_block(device, physical_block):
             raise ValueError(f"Physical block {physical_block} on device {device.name} already in use.")
+        self._make_private()
         if device not in self._physical_to_virtual_map:
             self._physical_to_virtual_map[device] = {}
         self._physical_to_virtual_map[device][physical_block] = virtual_block
         self._virtual_to_physical_map[virtual_block] = (device, physical_block)
         
-    def update_mapping(self, virtual_block:int, new_device:Device, new_physical_block:int) -> tuple[Device, int]:
+    def update_mapping(self, virtual_block:int, new_device:VirtualDevice, new_physical_block:int) -> tuple[VirtualDevice, int]:
         """Update a mapping in the mapping table.
 
         Args:
             virtual_block (int): the virtual block to update
-            new_device (Device): the new physical device for that block
+            new_device (VirtualDevice): the new physical device for that block
             new_physical_block (int): the new physical block for that block
             
         Raises:
@@ -41,18 +51,74 @@ class PhysicalVirtualBlockMapping:
             ValueError: if the physical block is already in use
             
         Returns:
-            tuple[Device, int]: the old device and physical block
+            tuple[VirtualDevice, int]: the old device and physical block
         """
         if not self.check_virtual_block(virtual_block):
             raise ValueError(f"Virtual block {virtual_block} not in use.")
         if self.check_physical_block(new_device, new_physical_block):
             raise ValueError(f"Physical block {new_physical_block} on device {new_device.name} already in use, cannot update mapping.")
+        self._make_private()
         old_device, old_physical_block = self.get_physical_block(virtual_block)
         self._virtual_to_physical_map[virtual_block] = (new_device, new_physical_block)
-        self._physical_to_virtual_map[new_device][new_physical_block] = virtual_block
+        self._physical_to_virtual_map.setdefault(new_device, {})[new_physical_block] = virtual_block
         self._physical_to_virtual_map[old_device].pop(old_physical_block)
         return old_device, old_physical_block
+    
+    def upsert_mapping(self, virtual_block:int, device:VirtualDevice, physical_block:int) -> Optional[tuple[VirtualDevice, int]]:
+        """Map a virtual block to a physical block, enrolling it if it is not in use yet and updating it otherwise.
+
+        Args:
+            virtual_block (int): the virtual block to map
+            device (VirtualDevice): the device for that block
+            physical_block (int): the physical block for that block
+            
+        Raises:
+            ValueError: if the physical block is already in use
+            
+        Returns:
+            Optional[tuple[VirtualDevice, int]]: the old device and physical block, None if the virtual block was not in use
+        """
+        if self.check_physical_block(device, physical_block):
+            raise ValueError(f"Physical block {physical_block} on device {device.name} already in use, cannot update mapping.")
+        self._make_private()
+        old_location = self._virtual_to_physical_map.get(virtual_block)
+        self._virtual_to_physical_map[virtual_block] = (device, physical_block)
+        self._physical_to_virtual_map.setdefault(device, {})[physical_block] = virtual_block
+        if old_location is not None:
+            self._physical_to_virtual_map[old_location[0]].pop(old_location[1])
+        return old_location
+        
         
+    def update_mapping_batch(self, mappings:list[tuple[int, VirtualDevice, int]]) -> list[Optional[tuple[VirtualDevice, int]]]:
+        """Map several virtual blocks at once, enrolling the ones not in use yet and updating the rest.
+
+        Args:
+            mappings (list[tuple[int, VirtualDevice, int]]): virtual block, new device and new physical block for each block to map
+            
+        Raises:
+            ValueError: if any of the physical blocks is already in use, nothing is changed in that case
+            
+        Returns:
+            list[Optional[tuple[VirtualDevice, int]]]: the old device and physical block for each entry, None for blocks that were not in use
+        """
+        # nothing to map, don't copy shared tables for it
+        if not mappings:
+            return []
+        for _, device, physical_block in mappings:
+            if self.check_physical_block(device, physical_block):
+                raise ValueError(f"Physical block {physical_block} on device {device.name} already in use, cannot update mapping.")
+        self._make_private()
+        virtual_to_physical = self._virtual_to_physical_map
+        physical_to_virtual = self._physical_to_virtual_map
+        old_locations:list[Optional[tuple[VirtualDevice, int]]] = []
+        for virtual_block, device, physical_block in mappings:
+            old_location = virtual_to_physical.get(virtual_block)
+            if old_location is not None:
+                physical_to_virtual[old_location[0]].pop(old_location[1])
+            virtual_to_physical[virtual_block] = (device, physical_block)
+            physical_to_virtual.setdefault(device, {})[physical_block] = virtual_block
+            old_locations.append(old_location)
+        return old_locations
         
     def unenroll_mapping(self, virtual_block:int):
         """Remove a mapping from the mapping table given the virtual block.
@@ -65,21 +131,20 @@ class PhysicalVirtualBlockMapping:
         """
         if not self.check_virtual_block(virtual_block):
             raise ValueError(f"Virtual block {virtual_block} not in use.")
+        self._make_private()
         device, physical_block = self._virtual_to_physical_map.pop(virtual_block)
         self._physical_to_virtual_map[device].pop(physical_block)
         
-    def unenroll_mapping_physical(self, device:Device, physical_block:int):
+    def unenroll_mapping_physical(self, device:VirtualDevice, physical_block:int):
         """Remove a mapping from the mapping table given the physical block.
 
         Args:
             device (PhysicalDevice): physical device to remove the mapping from
             physical_block (int): block on that device to remove the mapping from
         """
-        print("unenroll_mapping_physical", physical_block)
-        print("Current:", self._physical_to_virtual_map[device])
         self.unenroll_mapping(self.get_virtual_block(device, physical_block))
         
-    def get_physical_block(self, virtual_block:int) -> tuple[Device, int]:
+    def get_physical_block(self, virtual_block:int) -> tuple[VirtualDevice, int]:
         """Get the physical block mapped to a virtual block.
         
         Args:
@@ -93,7 +158,19 @@ class PhysicalVirtualBlockMapping:
         """
         return self._virtual_to_physical_map[virtual_block]
     
-    def get_virtual_block(self, device:Device, physical_block:int) -> int:
+    def try_get_physical_block(self, virtual_block:int) -> Optional[tuple[VirtualDevice, int]]:
+        """Get the physical block mapped to a virtual block, if there is one.
+        Combines check_virtual_block and get_physical_block in a single lookup.
+
+        Args:
+            virtual_block (int): block to get the physical block for
+
+        Returns:
+            Optional[tuple[VirtualDevice, int]]: device and block number on that device, or None if the virtual block is not mapped
+        """
+        return self._virtual_to_physical_map.get(virtual_block)
+    
+    def get_virtual_block(self, device:VirtualDevice, physical_block:int) -> int:
         """Get the virtual block mapped to a physical block.
 
         Args:
@@ -119,7 +196,7 @@ class PhysicalVirtualBlockMapping:
         """        
         return virtual_block in self._virtual_to_physical_map
     
-    def check_physical_block(self, device:Device, physical_block:int) -> bool:
+    def check_physical_block(self, device:VirtualDevice, physical_block:int) -> bool:
         """Check if a physical block is mapped.
 
         Args:
@@ -129,7 +206,8 @@ class PhysicalVirtualBlockMapping:
         Returns:
             bool: True if the block is mapped, False otherwise
         """        
-        return physical_block in self._physical_to_virtual_map.get(device, {})
+        device_map = self._physical_to_virtual_map.get(device)
+        return device_map is not None and physical_block in device_map
     
     def get_virtual_block_usage_set(self) -> set[int]:
         """Get the currently mapped virtual blocks.
@@ -140,22 +218,49 @@ class PhysicalVirtualBlockMapping:
         """
         return set(self._virtual_to_physical_map.keys())
     
-    def get_physical_block_usage_sets(self) -> dict[Device, set[int]]:
+    def get_virtual_block_count(self) -> int:
+        """Get the number of mapped virtual blocks.
+
+        Returns:
+            int: number of mapped virtual blocks
+        """
+        return len(self._virtual_to_physical_map)
+    
+    def get_unmapped_virtual_blocks(self, virtual_blocks:set[int]) -> set[int]:
+        """Get the virtual blocks out of a set that are not mapped, without building a set of the mapped ones.
+
+        Args:
+            virtual_blocks (set[int]): blocks to check
+
+        Returns:
+            set[int]: the blocks that are not mapped
+        """
+        return virtual_blocks.difference(self._virtual_to_physical_map)
+    
+    def get_physical_block_usage_sets(self) -> dict[VirtualDevice, set[int]]:
         """Get the currently mapped physical blocks for each device.
 
         Returns:
-            dict[Device, set[int]]: Device -> {physical blocks mapped}
+            dict[VirtualDevice, set[int]]: Device -> {physical blocks mapped}
         """
-        output:dict[Device,set[int]] = {}
+        output:dict[VirtualDevice,set[int]] = {}
         for device, mapping in self._physical_to_virtual_map.items():
             output[device] = set(mapping.keys())
         return output
     
     def get_snapshot(self) -> PhysicalVirtualBlockMapping:
+        """Get an independent copy of this mapping, the devices themselves are shared.
+        The copy is copy-on-write: both mappings share the same tables until one of them changes, which copies them first.
+        Snapshots taken without changes in between all share a single set of tables.
+
+        Returns:
+            PhysicalVirtualBlockMapping: the copy
+        """
         new_map = PhysicalVirtualBlockMapping()
-        for device in self._physical_to_virtual_map:
-            for physical_block, virtual_block in self._physical_to_virtual_map[device].items():
-                new_map.enroll_mapping(device, physical_block, virtual_block)
+        new_map._virtual_to_physical_map = self._virtual_to_physical_map
+        new_map._physical_to_virtual_map = self._physical_to_virtual_map
+        new_map._shared = True
+        self._shared = True
         return new_map
     
     
\ No newline at end of file
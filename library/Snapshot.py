@@ -1,3 +1,5 @@
+from typing import Optional
+
 from library.PhysicalVirtualBlockMapping import PhysicalVirtualBlockMapping
 
 class Snapshot:
@@ -5,6 +7,17 @@ class Snapshot:
     """
     def __init__(self, mapping:PhysicalVirtualBlockMapping):
         self._mapping = mapping.get_snapshot()
+        self._virtual_block_usage:Optional[frozenset[int]] = None # the mapping never changes, so this is computed once on first use
         
     def get_mapping(self) -> PhysicalVirtualBlockMapping:
-        return self._mapping
\ No newline at end of file
+        return self._mapping
+    
+    def get_virtual_block_usage_set(self) -> frozenset[int]:
+        """Get the virtual blocks mapped in this snapshot, computed on the first call and cached after that.
+
+        Returns:
+            frozenset[int]: set of virtual blocks
+        """
+        if self._virtual_block_usage is None:
+            self._virtual_block_usage = frozenset(self._mapping.get_virtual_block_usage_set())
+        return self._virtual_block_usage
@@ -1,58 +1,68 @@
-import logging
+from array import array
 from typing import Optional
+import heapq
+import logging
 
 from library.Device.VirtualDevice import VirtualDevice
 from library.PhysicalVirtualBlockMapping import PhysicalVirtualBlockMapping
 from library.Snapshot import Snapshot
 
+# the used maps are summarized in chunks of 2**_CHUNK_BITS blocks, so allocation can skip chunks with no free block
+_CHUNK_BITS = 12
+_CHUNK_SIZE = 1 << _CHUNK_BITS
+
 class StoragePool:
     """A storage pool is a collection of virtual devices that can be used to store data, no redundancy is available at this level.
     The pool level is where the CoW functionality is implemented."""
     
-    def __init__(self, name:str, devices:list[VirtualDevice], logger:Optional[logging.Logger]):
+    def __init__(self, name:str, devices:list[VirtualDevice], logger:Optional[logging.Logger], read_cache_size:int=0):
         """Create a storage pool from a list of virtual devices.
         
         Args:
             devices (list[VirtualDevice]): the devices in the storage pool
+            read_cache_size (int, optional): number of slots in a direct-mapped cache of recently read blocks of the current mapping, must be a power of two, 0 disables the cache.
+                Cache hits skip the devices entirely, including any integrity check they do on reads. Defaults to 0.
         Raises:
             ValueError: if the devices have different sizes or block sizes
+            ValueError: if the read cache size is not 0 or a power of two
         """
         
         if len(set(d.get_block_size() for d in devices)) != 1:
             raise ValueError("All devices must have the same block size.")
+        if read_cache_size < 0 or read_cache_size & (read_cache_size - 1):
+            raise ValueError(f"Read cache size {read_cache_size} is not 0 or a power of two.")
         self.name = name
         self._devices = devices
         self._block_size = devices[0].get_block_size()
         self._size = sum(d.get_size() for d in devices)
+        self._total_blocks = self._size // self._block_size
+        # per device bookkeeping is kept as parallel lists indexed by the device's position in the pool (see _device_index)
+        self._blocks_per_device:list[int] = [d.get_size() // self._block_size for d in devices]
         
         self._mapping:PhysicalVirtualBlockMapping = PhysicalVirtualBlockMapping()
         
         self._snapshots:list[Snapshot] = []
+        # block number -> (block number, data), indexed by the low bits of the block number
+        self._read_cache:list[Optional[tuple[int, bytes]]] = [None] * read_cache_size
+        self._read_cache_mask = read_cache_size - 1
+        self._snapshot_virtual_blocks:Optional[set[int]] = set() # union of the snapshots' virtual blocks, None until rebuilt after a snapshot is deleted
             
         self.logger = logger if logger is not None else logging.getLogger(__name__)
         
+        self._device_index:dict[VirtualDevice, int] = {d: i for i, d in enumerate(devices)}
         self._new_block_number = [0 for _ in range(len(devices))] # where to start looking for each device's new block allocations
-        
-    def _get_physical_blocks_used(self, filter_device:Optional[VirtualDevice]=None) -> dict[VirtualDevice, set[int]]:
-        """Get the physical blocks used by each device, whether in snapshots or the active mapping
-
-        Args:
-            filter_device (Optional[VirtualDevice], optional): if set, filter to this device only. Defaults to None.
-
-        Returns:
-            dict[VirtualDevice, set[int]]: device -> {physical block numbers in use}
-        """           
-        physical_blocks_used:dict[VirtualDevice,set[int]] = {}
-        for device in self._devices:
-            physical_blocks_used[device] = set()
-        for mapping in [self._mapping] + [snapshot.get_mapping() for snapshot in self._snapshots]:
-            for device, blocks in mapping.get_physical_block_usage_sets().items():
-                if filter_device is not None and device != filter_device:
-                    continue
-                if not isinstance(device, VirtualDevice):
-                    raise SyntaxError("Device is not a virtual device, this should never happen and is here for type checking.")
-                physical_blocks_used[device].update(blocks)
-        return physical_blocks_used
+        # per device physical block reference counts, maintained incrementally: one reference from the active mapping and one from each snapshot holding the block
+        self._refcounts:list[array] = [array("I", [0]) * n for n in self._blocks_per_device]
+        # a block is used while its refcount is non zero, mirrored as one byte per block (0 = free, 1 = used) so the next free block is a single bytearray.find
+        self._used_maps:list[bytearray] = [bytearray(n) for n in self._blocks_per_device]
+        self._used_counts:list[int] = [0] * len(devices)
+        self._used_block_count = 0
+        # per chunk free block counts, and one byte per chunk (0 = has a free block, 1 = full) searched before the used map itself
+        self._chunk_free_counts:list[array] = [array("I", [min(_CHUNK_SIZE, n - c) for c in range(0, n, _CHUNK_SIZE)]) for n in self._blocks_per_device]
+        self._full_chunks:list[bytearray] = [bytearray(len(counts)) for counts in self._chunk_free_counts]
+        # with a single device there is no device to pick, bind the allocator that goes straight to its free block search
+        if len(devices) == 1:
+            self._allocate_new_physical_block = self._allocate_new_physical_block_single_device # type: ignore
         
     def _allocate_new_physical_block(self) -> tuple[VirtualDevice, int]:
         """allocate a physical block from the devices in the storage pool
@@ -63,31 +73,165 @@ class StoragePool:
         Returns:
             tuple[VirtualDevice, int]: a tuple of the device and physical block number that was allocated
         """
-        physical_blocks_used = self._get_physical_blocks_used()
-        min_device = min({d: len(blocks) for d, blocks in physical_blocks_used.items()}.items(), key=lambda x: x[1])[0] 
-        new_block_number = self._new_block_number[self._devices.index(min_device)]
-        # increment until we find an unused one
-        traversed_count = 0
-        while new_block_number in physical_blocks_used.get(min_device, set()):
-            new_block_number += 1
-            traversed_count += 1
-            if new_block_number >= min_device.get_size() // self._block_size:
-                new_block_number = 0
-            if traversed_count > min_device.get_size() // self._block_size:
-                raise ValueError("All blocks in use.")
-        self._new_block_number[self._devices.index(min_device)] = new_block_number + 1
-        if self._new_block_number[self._devices.index(min_device)] >= min_device.get_size() // self._block_size:
-            self._new_block_number[self._devices.index(min_device)] = 0
-        return min_device, new_block_number
+        # least used device that still has a free block
+        used_counts = self._used_counts
+        blocks_per_device = self._blocks_per_device
+        device_index = -1
+        min_used = 0
+        for i, used in enumerate(used_counts):
+            if used < blocks_per_device[i] and (device_index == -1 or used < min_used):
+                device_index = i
+                min_used = used
+        if device_index == -1:
+            raise ValueError("All blocks in use.")
+        return self._devices[device_index], self._next_free_block(device_index)
+    
+    def _allocate_new_physical_block_single_device(self) -> tuple[VirtualDevice, int]:
+        """_allocate_new_physical_block for pools with a single device, installed over it by __init__
+        
+        Raises:
+            ValueError: if all blocks are in use
+
+        Returns:
+            tuple[VirtualDevice, int]: a tuple of the device and physical block number that was allocated
+        """
+        if self._used_counts[0] == self._blocks_per_device[0]:
+            raise ValueError("All blocks in use.")
+        return self._devices[0], self._next_free_block(0)
+    
+    def _next_free_block(self, device_index:int) -> int:
+        """find the next free block on a device and move its cursor past it, the device must have a free block
+
+        Args:
+            device_index (int): index of the device to search
+
+        Returns:
+            int: the free physical block number
+        """
+        used_map = self._used_maps[device_index]
+        # next fit: the first free block at or after the device's cursor, wrapping around to the start
+        start = self._new_block_number[device_index]
+        new_block_number = used_map.find(0, start, (start | (_CHUNK_SIZE - 1)) + 1)
+        if new_block_number == -1:
+            # rest of the cursor's chunk is full, jump to the next chunk that isn't
+            full_chunks = self._full_chunks[device_index]
+            chunk = full_chunks.find(0, (start >> _CHUNK_BITS) + 1)
+            if chunk == -1:
+                chunk = full_chunks.find(0)
+            new_block_number = used_map.find(0, chunk << _CHUNK_BITS, (chunk + 1) << _CHUNK_BITS)
+        self._new_block_number[device_index] = new_block_number + 1 if new_block_number + 1 < self._blocks_per_device[device_index] else 0
+        return new_block_number
+    
+    def _allocate_new_physical_blocks(self, count:int) -> list[tuple[VirtualDevice, int]]:
+        """allocate several physical blocks in one pass, spread over the devices the same way repeated single allocations would be
+        each block is referenced as it is allocated so it can't be handed out twice, drop the reference of any block that ends up unused
+        
+        Args:
+            count (int): number of blocks to allocate
+        
+        Raises:
+            ValueError: if there are fewer than count free blocks, nothing is allocated in that case
+        
+        Returns:
+            list[tuple[VirtualDevice, int]]: the device and physical block number of each allocated block
+        """
+        if count > self._total_blocks - self._used_block_count:
+            raise ValueError("All blocks in use.")
+        # least used device first, ties go to the earlier device like min() in _allocate_new_physical_block
+        used_counts = self._used_counts
+        blocks_per_device = self._blocks_per_device
+        heap = [(used_counts[i], i) for i in range(len(self._devices)) if used_counts[i] < blocks_per_device[i]]
+        heapq.heapify(heap)
+        allocated:list[tuple[VirtualDevice, int]] = []
+        for _ in range(count):
+            _, i = heapq.heappop(heap)
+            device = self._devices[i]
+            physical_block = self._next_free_block(i)
+            self._ref_physical_block(device, physical_block)
+            allocated.append((device, physical_block))
+            if used_counts[i] < blocks_per_device[i]:
+                heapq.heappush(heap, (used_counts[i], i))
+        return allocated
+    
+    def _allocate_contiguous_run(self, count:int) -> Optional[tuple[VirtualDevice, int]]:
+        """allocate count consecutive physical blocks on a single device, trying the least used devices first
+        the blocks are referenced as they are allocated, like _allocate_new_physical_blocks
+        
+        Args:
+            count (int): number of blocks in the run
+        
+        Returns:
+            Optional[tuple[VirtualDevice, int]]: the device and first physical block of the run, or None if no device has a free run that long
+        """
+        free_run = bytes(count)
+        used_counts = self._used_counts
+        for i in sorted(range(len(self._devices)), key=used_counts.__getitem__):
+            if self._blocks_per_device[i] - used_counts[i] < count:
+                continue
+            # same next fit order as single blocks, from the cursor and then wrapping to the start
+            used_map = self._used_maps[i]
+            physical_start = used_map.find(free_run, self._new_block_number[i])
+            if physical_start == -1:
+                physical_start = used_map.find(free_run)
+            if physical_start == -1:
+                continue
+            device = self._devices[i]
+            for physical_block in range(physical_start, physical_start + count):
+                self._ref_physical_block(device, physical_block)
+            self._new_block_number[i] = physical_start + count if physical_start + count < self._blocks_per_device[i] else 0
+            return device, physical_start
+        return None
     
-    def _free_physical_block(self, device:VirtualDevice, physical_block_number:int):
+    def _free_physical_block(self, device:VirtualDevice, physical_block_number:int, virtual_block_number:int):
         """Free a physical block on a device
 
         Args:
             device (VirtualDevice): the device to free the block on
             physical_block_number (int): the physical block number to free
+            virtual_block_number (int): the virtual block mapped to it, so the mapping is removed without a reverse lookup
+        """
+        self._mapping.unenroll_mapping(virtual_block_number)
+        self._unref_physical_block(device, physical_block_number)
+        
+    def _ref_physical_block(self, device:VirtualDevice, physical_block_number:int):
+        """Add a reference to a physical block, marking it used if it was free
+
+        Args:
+            device (VirtualDevice): the device the block is on
+            physical_block_number (int): the physical block number
+        """
+        device_index = self._device_index[device]
+        refcounts = self._refcounts[device_index]
+        refcounts[physical_block_number] += 1
+        if refcounts[physical_block_number] == 1:
+            self._used_maps[device_index][physical_block_number] = 1
+            self._used_counts[device_index] += 1
+            self._used_block_count += 1
+            chunk = physical_block_number >> _CHUNK_BITS
+            chunk_free_counts = self._chunk_free_counts[device_index]
+            chunk_free_counts[chunk] -= 1
+            if chunk_free_counts[chunk] == 0:
+                self._full_chunks[device_index][chunk] = 1
+    
+    def _unref_physical_block(self, device:VirtualDevice, physical_block_number:int):
+        """Drop a reference to a physical block, marking it free once nothing references it
+
+        Args:
+            device (VirtualDevice): the device the block is on
+            physical_block_number (int): the physical block number
         """
-        self._mapping.unenroll_mapping_physical(device, physical_block_number)
+        device_index = self._device_index[device]
+        refcounts = self._refcounts[device_index]
+        refcounts[physical_block_number] -= 1
+        if refcounts[physical_block_number] == 0:
+            self._used_maps[device_index][physical_block_number] = 0
+            self._used_counts[device_index] -= 1
+            self._used_block_count -= 1
+            chunk = physical_block_number >> _CHUNK_BITS
+            chunk_free_counts = self._chunk_free_counts[device_index]
+            if chunk_free_counts[chunk] == 0:
+                self._full_chunks[device_index][chunk] = 0
+            chunk_free_counts[chunk] += 1
         
     def bytes2block_count(self, bytes:int) -> int:
         """Given a number of bytes, return the number of blocks needed to store that many bytes
@@ -117,7 +261,7 @@ class StoragePool:
 
         Args:
             block_number (int): the block number to read
-            snapshot (Optional[None], optional): If set, this snapshot will be used for the reading. Defaults to None.
+            snapshot (Optional[Snapshot], optional): If set, this snapshot will be used for the reading. Defaults to None.
             
         Raises:
             ValueError: if the block number is out of range
@@ -126,42 +270,89 @@ class StoragePool:
         Returns:
             bytes: the block data
         """
-        mapping = snapshot.get_mapping() if snapshot is not None else self._mapping
-        if not mapping.check_virtual_block(block_number):
+        if snapshot is not None:
+            location = snapshot.get_mapping().try_get_physical_block(block_number)
+            if location is None:
+                raise ValueError(f"Block {block_number} not in use.")
+            return self.read_physical_block(*location)
+        if self._read_cache:
+            cached = self._read_cache[block_number & self._read_cache_mask]
+            if cached is not None and cached[0] == block_number:
+                return cached[1]
+        location = self._mapping.try_get_physical_block(block_number)
+        if location is None:
             raise ValueError(f"Block {block_number} not in use.")
-        device, physical_block = mapping.get_physical_block(block_number)
-        if not isinstance(device, VirtualDevice):
-            raise SyntaxError("Device is not a virtual device, this should never happen and is here for type checking.")
-        return self.read_physical_block(device, physical_block)
+        data = self.read_physical_block(*location)
+        if self._read_cache:
+            self._read_cache[block_number & self._read_cache_mask] = (block_number, data)
+        return data
+    
+    def _invalidate_read_cache(self, block_number:int):
+        """Drop a virtual block from the read cache, must be called whenever the block is remapped or freed
+
+        Args:
+            block_number (int): the virtual block number
+        """
+        if self._read_cache:
+            slot = block_number & self._read_cache_mask
+            cached = self._read_cache[slot]
+            if cached is not None and cached[0] == block_number:
+                self._read_cache[slot] = None
     
-    def read_virtual_blocks(self, start_block:int, end_block:int, snapshot:Optional[None] = None) -> bytes:
+    def read_virtual_blocks(self, start_block:int, end_block:int, snapshot:Optional[Snapshot] = None) -> bytes:
         """Read multiple blocks from the storage pool, starting at the given block number
 
         Args:
             start_block (int): block number to start reading at
             end_block (int): block number to stop reading at (inclusive)
-            snapshot (Optional[None], optional): If set, this snapshot will be used for the reading. Defaults to None.
+            snapshot (Optional[Snapshot], optional): If set, this snapshot will be used for the reading. Defaults to None.
+            
+        Raises:
+            ValueError: if any block in the range is not in use
 
         Returns:
             bytes: the data read
         """
-        data = b""
-        for i in range(start_block, end_block+1):
-            data += self.read_virtual_block(i, snapshot)
-        return data
+        mapping = snapshot.get_mapping() if snapshot is not None else self._mapping
+        count = end_block - start_block + 1
+        if count <= 0:
+            return b""
+        # resolve every block first, grouped by device as (physical block, position in the output)
+        by_device:dict[VirtualDevice, list[tuple[int, int]]] = {}
+        for i in range(count):
+            location = mapping.try_get_physical_block(start_block + i)
+            if location is None:
+                raise ValueError(f"Block {start_block + i} not in use.")
+            device, physical_block = location
+            by_device.setdefault(device, []).append((physical_block, i))
+        
+        buf = bytearray(count * self._block_size)
+        view = memoryview(buf)
+        # read each device in physical block order, runs that are consecutive both on the device and in the output are read in one go
+        for device, locations in by_device.items():
+            locations.sort()
+            run_start = 0
+            for j in range(1, len(locations) + 1):
+                if j < len(locations) and locations[j][0] == locations[j - 1][0] + 1 and locations[j][1] == locations[j - 1][1] + 1:
+                    continue
+                physical_block, i = locations[run_start]
+                run_length = j - run_start
+                view[i * self._block_size:(i + run_length) * self._block_size] = device.read_blocks(physical_block, run_length)
+                run_start = j
+        return bytes(buf)
     
-    def read_virtual_blocks_byte_count(self, start_block:int, bytes_count:int, snapshot:Optional[None] = None) -> bytes:
+    def read_virtual_blocks_byte_count(self, start_block:int, bytes_count:int, snapshot:Optional[Snapshot] = None) -> bytes:
         """Read a number of bytes from the storage pool, starting at the given block number
 
         Args:
             start_block (int): block number to start reading at
             bytes_count (int): number of bytes to read
-            snapshot (Optional[None], optional): If set, this snapshot will be used for the reading. Defaults to None.
+            snapshot (Optional[Snapshot], optional): If set, this snapshot will be used for the reading. Defaults to None.
 
         Returns:
             bytes: the data read
         """
-        end_block = start_block + self.bytes2block_count(bytes_count)
+        end_block = start_block + self.bytes2block_count(bytes_count) - 1 # read_virtual_blocks' end block is inclusive
         return self.read_virtual_blocks(start_block, end_block, snapshot)[:bytes_count]        
     
     def write_virtual_block(self, block_number:int, data:bytes) -> bool:
@@ -178,7 +369,7 @@ class StoragePool:
         Returns:
             bool: True if the write was successful, False otherwise
         """
-        if block_number < 0 or block_number >= self._size // self._block_size:
+        if block_number < 0 or block_number >= self._total_blocks:
             raise ValueError(f"Block number {block_number} out of range.")
         if len(data) != self._block_size:
             raise ValueError(f"Tried to write {len(data)} bytes to a block of size {self._block_size}.")
@@ -188,17 +379,12 @@ class StoragePool:
         success = new_device.write_block(new_physical_block, data)
         if not success:
             return False
-        if not self._mapping.check_virtual_block(block_number): # if its a fresh block, no need to update mapping
-            self._mapping.enroll_mapping(new_device, new_physical_block, block_number)
-            return True
-        
-        # this block was in use, check if we need to remove the old block
-        self._mapping.update_mapping(block_number, new_device, new_physical_block)
-        # if not isinstance(old_device, VirtualDevice):
-        #     raise SyntaxError("Device is not a virtual device, this should never happen and is here for type checking.")
-        # # remove user from old block
-        # if old_block not in self._get_physical_blocks_used(old_device)[old_device]:
-        #     self._free_physical_block(old_device, old_block) # TODO this is the current source of the keyerror bug
+        self._ref_physical_block(new_device, new_physical_block)
+        self._invalidate_read_cache(block_number)
+        old_location = self._mapping.upsert_mapping(block_number, new_device, new_physical_block)
+        if old_location is not None:
+            # this block was in use, the old block is free unless a snapshot still holds it
+            self._unref_physical_block(*old_location)
         return True
     
     def write_virtual_blocks(self, start_block:int, data:bytes) -> bool:
@@ -215,17 +401,45 @@ class StoragePool:
         Returns:
             bool: True if all writes were successful, False otherwise
         """
-        pad_length = self._block_size - (len(data) % self._block_size)
-        data += b"\x00" * pad_length
+        pad_length = -len(data) % self._block_size
+        if pad_length:
+            # copy once into a zero filled buffer instead of concatenating a padding object
+            padded = bytearray(len(data) + pad_length)
+            padded[:len(data)] = data
+            data = padded
         end_block = start_block + len(data) // self._block_size
-        if start_block < 0 or start_block > self._size // self._block_size:
+        if start_block < 0 or start_block > self._total_blocks:
             raise ValueError(f"Start block number {start_block} out of range.")
-        if end_block < 0 or end_block > self._size // self._block_size:
+        if end_block < 0 or end_block > self._total_blocks:
             raise ValueError(f"End block number {end_block} out of range.")
+        view = memoryview(data)
+        block_size = self._block_size
+        count = end_block - start_block
         all_successful = True
-        for i, block_to_write in enumerate(range(start_block, end_block)):
-            data_fragment = data[i*self._block_size:(i+1)*self._block_size]
-            all_successful = all_successful and self.write_virtual_block(block_to_write, data_fragment)
+        written:list[tuple[int, VirtualDevice, int]] = []
+        run = self._allocate_contiguous_run(count) if count > 1 else None
+        if run is not None:
+            # the whole range fits in one run, the device sees a single sequential write
+            device, physical_start = run
+            if not device.write_blocks(physical_start, view):
+                for physical_block in range(physical_start, physical_start + count):
+                    self._unref_physical_block(device, physical_block)
+                return False
+            written = [(start_block + i, device, physical_start + i) for i in range(count)]
+        else:
+            for i, (device, physical_block) in enumerate(self._allocate_new_physical_blocks(count)):
+                if device.write_block(physical_block, view[i*block_size:(i+1)*block_size]):
+                    written.append((start_block + i, device, physical_block))
+                else:
+                    self._unref_physical_block(device, physical_block)
+                    all_successful = False
+        if self._read_cache:
+            for virtual_block, _, _ in written:
+                self._invalidate_read_cache(virtual_block)
+        # blocks that were in use are free unless a snapshot still holds them
+        for old_location in self._mapping.update_mapping_batch(written):
+            if old_location is not None:
+                self._unref_physical_block(*old_location)
         return all_successful
                 
     
@@ -238,13 +452,13 @@ class StoragePool:
         Raises:
             ValueError: if the block was not in use
         """
-        if not self._mapping.check_virtual_block(block_number):
+        location = self._mapping.try_get_physical_block(block_number)
+        if location is None:
             raise ValueError(f"Block {block_number} not in use.")
-        device, physical_block = self._mapping.get_physical_block(block_number)
-        if not isinstance(device, VirtualDevice):
-            raise SyntaxError("Device is not a virtual device, this should never happen and is here for type checking.")
+        device, physical_block = location
         
-        self._free_physical_block(device, physical_block)
+        self._invalidate_read_cache(block_number)
+        self._free_physical_block(device, physical_block, block_number)
             
     def get_fullness(self) -> float:
         """Get the fullness of the storage pool
@@ -252,9 +466,7 @@ class StoragePool:
         Returns:
             float: the fullness between 0 and 1
         """        
-        total_blocks = self._size // self._block_size
-        used_space = sum(len(blocks) for blocks in self._get_physical_blocks_used().values())
-        return used_space / total_blocks
+        return self._used_block_count / self._total_blocks
     
     def get_free_block_count(self) -> int:
         """Get the number of free blocks in the storage pool
@@ -262,9 +474,7 @@ class StoragePool:
         Returns:
             int: number of blocks available
         """
-        total_blocks = self._size // self._block_size
-        used_space = sum(len(blocks) for blocks in self._get_physical_blocks_used().values())
-        return total_blocks - used_space
+        return self._total_blocks - self._used_block_count
     
     def get_usage_stats(self) -> tuple[int,int,int]:
         """Get the usage statistics for the storage pool
@@ -272,19 +482,22 @@ class StoragePool:
         Returns:
             tuple[int,int,int]: actively used blocks, snapshot used blocks, free blocks
         """
-        total_blocks = self._size // self._block_size
-        current_blocks = self._mapping.get_virtual_block_usage_set()
-        snapshot_blocks:set[int] = set()
-        for snapshot in self._snapshots:
-            usage_set = snapshot.get_mapping().get_virtual_block_usage_set()
-            snapshot_blocks.update(usage_set)
-        exclusive_snapshot_blocks = snapshot_blocks - current_blocks
-        return len(current_blocks), len(exclusive_snapshot_blocks), total_blocks - len(current_blocks) - len(exclusive_snapshot_blocks)
+        # snapshots never change once captured, so their union only needs rebuilding after one is deleted
+        if self._snapshot_virtual_blocks is None:
+            self._snapshot_virtual_blocks = set().union(*(s.get_virtual_block_usage_set() for s in self._snapshots))
+        current_count = self._mapping.get_virtual_block_count()
+        exclusive_count = len(self._mapping.get_unmapped_virtual_blocks(self._snapshot_virtual_blocks))
+        return current_count, exclusive_count, self._total_blocks - current_count - exclusive_count
     
     def capture_snapshot(self) -> Snapshot:
         """Capture a snapshot of the storage pool"""
         snapshot = Snapshot(self._mapping)
         self._snapshots.append(snapshot)
+        if self._snapshot_virtual_blocks is not None:
+            self._snapshot_virtual_blocks.update(snapshot.get_virtual_block_usage_set())
+        for device, blocks in snapshot.get_mapping().get_physical_block_usage_sets().items():
+            for physical_block in blocks:
+                self._ref_physical_block(device, physical_block)
         return snapshot
     
     def get_snapshots(self) -> list[Snapshot]:
@@ -303,13 +516,17 @@ class StoragePool:
             snapshot (Snapshot): the snapshot to delete
         """
         self._snapshots.remove(snapshot)
+        self._snapshot_virtual_blocks = None
+        for device, blocks in snapshot.get_mapping().get_physical_block_usage_sets().items():
+            for physical_block in blocks:
+                self._unref_physical_block(device, physical_block)
         
     def get_num_blocks(self) -> int:
         """
         Returns:
             int: The number of blocks in the pool
         """       
-        return self._size // self._block_size 
+        return self._total_blocks
     
     def get_block_size(self) -> int: 
         """
@@ -325,4 +542,15 @@ class StoragePool:
         """        
         return self._mapping.get_virtual_block_usage_set()
     
+    def check_virtual_block(self, block_number:int) -> bool:
+        """Check if a virtual block is in use.
+
+        Args:
+            block_number (int): the block number to check
+
+        Returns:
+            bool: True if the block is in use, False otherwise
+        """
+        return self._mapping.check_virtual_block(block_number)
+    
         
\ No newline at end of file
@@ -1,4 +1,6 @@
 import logging
+import os
+import tempfile
 
 
 from library.Device.PhysicalDevice import PhysicalDevice
@@ -50,7 +52,7 @@ def test1():
     print_all_details()
     input("Press enter to manually edit pd2's data to simulate a bad sector")
     testLogger.info("Manually editing pd2's data")
-    pd2._data[10:20] = b"BadDataBadD" # type: ignore
+    pd2._data[10:20] = b"BadDataBad" # type: ignore
     input("Edited pd2's data, press enter to discover error")
     assert isinstance(vd, VirtualDeviceMirror)
     vd.check_all_integrity()
@@ -73,14 +75,14 @@ def test2():
     
     vd1.attempt_bring_online()
     vd2.attempt_bring_online()
-    
-    for i in range(20):
-        string_to_write = f"Hellohel{i+1:02d}".encode()
+    # build the block contents once, the write loop and the read-back below both use them
+    # build the block contents up front so the loops below only time the pool
+    strings_to_write = [b"Hellohel" + f"{i+1:02d}".encode("ascii") for i in range(20)]
+    for i, string_to_write in enumerate(strings_to_write):
         sp.write_virtual_block(i, string_to_write)
         pretty_print_usage_stats(sp)
         
-    for i in range(20):
-        expected_string = f"Hellohel{i+1:02d}".encode()
+    for i, expected_string in enumerate(strings_to_write):
         assert sp.read_virtual_block(i) == expected_string
     print("All reads successful")
     
@@ -182,4 +184,194 @@ def test4():
 test4()
     
     
-    
\ No newline at end of file
+    
+def test5():
+    pd1 = PhysicalDevice("pd1",8192, 16) # 512 blocks, block numbers don't fit in a byte
+    vd1 = VirtualDeviceFactory.create_virtual_device("vdev1", [pd1], "stripe", testLogger)
+    sp = StoragePool("sp1", [vd1], testLogger)
+    filesystem = FileSystem(sp)
+    
+    filesystem.write_file("file1", b"Hello World!"*10)
+    assert filesystem.read_file("file1").decode() == "Hello World!"*10
+    filesystem.write_file("file2", b"Hello World again!")
+    assert filesystem.read_file("file2").decode() == "Hello World again!"
+    assert filesystem.read_file("file1").decode() == "Hello World!"*10
+    print("Test 5 passed (filesystem with more than 256 blocks)")
+test5()
+    
+    
+def test6():
+    pd1 = PhysicalDevice("pd1", 100, 10, cache_size=2)
+    pd1.attempt_bring_online()
+    pd1.write_block(0, b"AAAAAAAAAA")
+    pd1.write_block(1, b"BBBBBBBBBB")
+    pd1.write_block(2, b"CCCCCCCCCC")
+    assert pd1.read_block(0) == b"AAAAAAAAAA"
+    pd1._data[0:10] = b"aaaaaaaaaa" # type: ignore
+    assert pd1.read_block(0) == b"AAAAAAAAAA" # served from the cache, the edit above went behind its back
+    pd1.read_block(1)
+    pd1.read_block(2) # block 0 is now the least recently used of 3, so it gets evicted
+    assert pd1.read_block(0) == b"aaaaaaaaaa"
+    pd1.write_block(0, b"ZZZZZZZZZZ")
+    assert pd1.read_block(0) == b"ZZZZZZZZZZ" # writes drop the cached copy
+    print("Test 6 passed (physical device read cache)")
+test6()
+    
+    
+def test7():
+    pd1 = PhysicalDevice("pd1", 100, 10)
+    pd2 = PhysicalDevice("pd2", 100, 10)
+    vd1 = VirtualDeviceMirror("vdev1", [pd1, pd2], testLogger, write_behind_blocks=4)
+    vd1.attempt_bring_online()
+    vd1.write_block(0, b"HelloHello")
+    vd1.write_block(1, b"WorldWorld")
+    assert vd1.read_block(5) == bytes(10) # a clean read of a block that isn't buffered
+    assert pd1.read_block(0) == bytes(10) and pd2.read_block(1) == bytes(10) # the buffered writes are still buffered
+    assert vd1.read_block(0) == b"HelloHello" # served from the buffer
+    assert vd1.sync()
+    for pd in [pd1, pd2]:
+        assert pd.read_block(0) == b"HelloHello" and pd.read_block(1) == b"WorldWorld"
+    print("Test 7 passed (mirror write-behind survives clean reads)")
+test7()
+    
+    
+def test8():
+    pd1 = PhysicalDevice("pd1", 100, 10, cache_size=16)
+    pd2 = PhysicalDevice("pd2", 100, 10, cache_size=16)
+    vd1 = VirtualDeviceFactory.create_virtual_device("vdev1", [pd1, pd2], "stripe", testLogger)
+    vd1.attempt_bring_online()
+    vd1.read_block(0)
+    vd1.read_block(1)
+    assert 3 not in pd1._cache # type: ignore
+    vd1.read_block(2) # third sequential read, the next blocks get prefetched into the device caches
+    assert all(block in pd1._cache for block in range(3, 10)) # type: ignore
+    assert 0 in pd2._cache # type: ignore # read-ahead carries on across the device boundary
+    print("Test 8 passed (stripe read-ahead)")
+test8()
+    
+    
+def test9():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "pd1.img")
+        pd1 = PhysicalDevice("pd1", 100, 10, path=path)
+        assert os.path.getsize(path) == 100
+        pd1.attempt_bring_online()
+        pd1.write_block(3, b"HelloHello")
+        pd1.close()
+        with open(path, "rb") as f:
+            assert f.read()[30:40] == b"HelloHello"
+        # a new device on the same file picks up the data
+        pd2 = PhysicalDevice("pd2", 100, 10, path=path)
+        pd2.attempt_bring_online()
+        assert pd2.read_block(3) == b"HelloHello"
+        pd2.close()
+    print("Test 9 passed (file backed physical device)")
+test9()
+    
+    
+def test10():
+    pds = [PhysicalDevice(f"pd{i+1}", 100, 10) for i in range(3)]
+    vd1 = VirtualDeviceMirror("vdev1", pds, testLogger, parallel_writes=True)
+    vd1.attempt_bring_online()
+    assert vd1.write_block(0, b"HelloHello")
+    assert vd1.write_blocks(1, b"WorldWorldAgainAgain")
+    for pd in pds:
+        assert pd.read_block(0) == b"HelloHello"
+        assert pd.read_blocks(1, 2) == b"WorldWorldAgainAgain"
+    assert vd1.check_all_integrity()
+    vd1.close()
+    print("Test 10 passed (parallel mirror writes)")
+test10()
+
+def test11():
+    pds = [PhysicalDevice(f"pd{i+1}", 100, 10) for i in range(6)]
+    mirror1 = VirtualDeviceMirror("mirror1", pds[:3], testLogger)
+    mirror2 = VirtualDeviceMirror("mirror2", pds[3:], testLogger)
+    stripe = VirtualDeviceStripe("stripe", [mirror1, mirror2], testLogger)
+    stripe.attempt_bring_online()
+    data = b"".join(f"Block{i:05d}".encode("ascii") for i in range(20))
+    assert stripe.write_blocks(0, data)
+    assert stripe.scrub_blocks(0, 20)
+    # corrupt two blocks on one leg of one mirror, behind the mirror's back
+    pds[5]._data[30:50] = b"X" * 20
+    assert not stripe.scrub_blocks(0, 20)
+    assert stripe.scrub_blocks(0, 20, repair=True)
+    assert pds[5].read_blocks(0, 10) == pds[4].read_blocks(0, 10) == pds[3].read_blocks(0, 10)
+    assert stripe.scrub_blocks(0, 20)
+    print("Test 11 passed (scrub repairs a stripe of mirrors)")
+test11()
+
+def test12():
+    pd1 = PhysicalDevice("pd1", 2048, 16)
+    vd1 = VirtualDeviceFactory.create_virtual_device("vdev1", [pd1], "stripe", testLogger)
+    sp = StoragePool("sp1", [vd1], testLogger)
+    assert not sp.check_virtual_block(0)
+    filesystem = FileSystem(sp)
+    # a blank pool gets an empty file table
+    assert sp.check_virtual_block(0)
+    assert len(filesystem._read_file_table().file_table) == 0
+    filesystem.write_file("file1", b"Hello World!")
+    filesystem.write_file("file2", b"Hello World again!"*5)
+    # opening the pool again keeps the files already on it
+    reopened = FileSystem(sp)
+    assert reopened.read_file("file1") == b"Hello World!"
+    assert reopened.read_file("file2") == b"Hello World again!"*5
+    reopened.write_file("file3", b"Hello World a third time!")
+    assert reopened.read_file("file1") == b"Hello World!"
+    assert filesystem.read_file("file3") == b"Hello World a third time!"
+    print("Test 12 passed (reopening a filesystem keeps its files)")
+test12()
+
+def test13():
+    pd1 = PhysicalDevice("pd1", 100, 10)
+    vd1 = VirtualDeviceFactory.create_virtual_device("vdev1", [pd1], "stripe", testLogger)
+    sp = StoragePool("sp1", [vd1], testLogger)
+    sp.write_virtual_blocks(0, b"Block00000Block00001Block00002")
+    snap1 = sp.capture_snapshot()
+    snap2 = sp.capture_snapshot()
+    # nothing changed between the snapshots, they share the pool's tables
+    assert snap1.get_mapping()._virtual_to_physical_map is snap2.get_mapping()._virtual_to_physical_map
+    assert snap1.get_mapping()._virtual_to_physical_map is sp._mapping._virtual_to_physical_map
+    sp.write_virtual_block(1, b"NewBlock01")
+    sp.free_virtual_block(2)
+    sp.write_virtual_block(5, b"NewBlock05")
+    # the pool copied its tables before changing them, the snapshots still share theirs
+    assert snap1.get_mapping()._virtual_to_physical_map is not sp._mapping._virtual_to_physical_map
+    assert snap1.get_mapping()._virtual_to_physical_map is snap2.get_mapping()._virtual_to_physical_map
+    for snap in (snap1, snap2):
+        assert sp.read_virtual_blocks(0, 2, snap) == b"Block00000Block00001Block00002"
+        assert not snap.get_mapping().check_virtual_block(5)
+    assert sp.read_virtual_block(1) == b"NewBlock01"
+    assert not sp.check_virtual_block(2)
+    assert sp.read_virtual_block(5) == b"NewBlock05"
+    print("Test 13 passed (copy-on-write snapshot mappings)")
+test13()
+
+def test14():
+    pd1 = PhysicalDevice("pd1", 100, 10)
+    vd1 = VirtualDeviceFactory.create_virtual_device("vdev1", [pd1], "stripe", testLogger)
+    sp = StoragePool("sp1", [vd1], testLogger, read_cache_size=4)
+    sp.write_virtual_block(3, b"AAAAAAAAAA")
+    assert sp.read_virtual_block(3) == b"AAAAAAAAAA"
+    # edit the block behind the pool's back, the next read is served from the cache
+    _, physical_block = sp._mapping.get_physical_block(3)
+    pd1._data[physical_block*10:(physical_block+1)*10] = b"XXXXXXXXXX"
+    assert sp.read_virtual_block(3) == b"AAAAAAAAAA"
+    sp.write_virtual_block(3, b"BBBBBBBBBB")
+    assert sp.read_virtual_block(3) == b"BBBBBBBBBB"
+    sp.write_virtual_blocks(2, b"CCCCCCCCCCDDDDDDDDDD")
+    assert sp.read_virtual_block(3) == b"DDDDDDDDDD"
+    snap = sp.capture_snapshot()
+    sp.write_virtual_block(3, b"EEEEEEEEEE")
+    assert sp.read_virtual_block(3) == b"EEEEEEEEEE"
+    # the live copy is cached now, the snapshot must still read its own
+    assert sp.read_virtual_block(3, snap) == b"DDDDDDDDDD"
+    sp.free_virtual_block(3)
+    try:
+        sp.read_virtual_block(3)
+    except ValueError as e:
+        assert str(e) == "Block 3 not in use."
+    else:
+        raise Exception("Should have failed")
+    print("Test 14 passed (storage pool read cache)")
+test14()